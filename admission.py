@@ -0,0 +1,162 @@
+"""Admission control for the routes that call the model.
+
+Each such route has a Gate: at most `concurrency` requests run at once
+and a bounded number wait for a slot. A request is shed straight away
+(429 with Retry-After) when the queue is full or its estimated wait,
+from the recent service time, exceeds the route's max wait. Students are
+also limited in how many requests they can have running at once, so one
+impatient student cannot hold every slot.
+
+Work is cancelled on a best-effort basis: a request carries a
+CancelToken that is cancelled once its deadline passes or the client
+has hung up, and checkpoint() is called between model calls to stop
+work nobody is waiting for. Hang-ups are seen by peeking at the client
+socket, which gunicorn and the werkzeug dev server expose.
+"""
+
+import contextvars
+import math
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+
+_token = contextvars.ContextVar("cancel_token", default=None)
+
+
+class Shed(Exception):
+    """The request was turned away before doing any work."""
+
+    def __init__(self, route, retry_after, reason):
+        super().__init__(reason)
+        self.route = route
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class Cancelled(Exception):
+    """The client is gone or out of time, so the request was abandoned."""
+
+
+class Gate:
+    def __init__(self, route, concurrency, queue, max_wait):
+        self.route = route
+        self.concurrency = concurrency
+        self.queue = queue
+        self.max_wait = max_wait
+        self.active = 0
+        self.waiting = 0
+        self.service = 1.0  # moving average of seconds per request
+        self.cond = threading.Condition()
+
+    def estimate(self):
+        """Seconds a request arriving now would wait for a slot."""
+        ahead = self.active + self.waiting - self.concurrency + 1
+        return max(0, ahead) * self.service / self.concurrency
+
+    def _shed(self, wait, reason):
+        metrics.inc("admission_total", route=self.route, result="shed")
+        raise Shed(self.route, wait, reason)
+
+    @contextmanager
+    def enter(self):
+        arrived = time.monotonic()
+        with self.cond:
+            if self.active >= self.concurrency:
+                wait = self.estimate()
+                if self.waiting >= self.queue:
+                    self._shed(wait, "Too many requests are waiting")
+                if wait > self.max_wait:
+                    self._shed(wait, f"Expected wait of {wait:.0f}s is too long")
+
+                self.waiting += 1
+                try:
+                    while self.active >= self.concurrency:
+                        left = arrived + self.max_wait - time.monotonic()
+                        if left <= 0:
+                            self._shed(self.estimate(), "Timed out waiting for a slot")
+                        self.cond.wait(min(left, 0.5))
+                        checkpoint()
+                finally:
+                    self.waiting -= 1
+            self.active += 1
+
+        metrics.inc("admission_total", route=self.route, result="admitted")
+        metrics.observe("admission_queue_seconds", time.monotonic() - arrived, route=self.route)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.active -= 1
+                self.service = 0.8 * self.service + 0.2 * (time.monotonic() - start)
+                self.cond.notify()
+
+
+class SessionLimit:
+    """At most `limit` requests in progress per student."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.counts = {}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def hold(self, sid):
+        with self.lock:
+            count = self.counts.get(sid, 0)
+            if count >= self.limit:
+                metrics.inc("admission_total", route="session", result="shed")
+                raise Shed("session", 1, "Please wait for your previous request to finish")
+            self.counts[sid] = count + 1
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.counts[sid] -= 1
+                if not self.counts[sid]:
+                    del self.counts[sid]
+
+
+def client_gone(environ):
+    """True if the client has closed its connection (best effort)."""
+    sock = environ.get("gunicorn.socket") or environ.get("werkzeug.socket")
+    if sock is None:
+        return False
+    try:
+        # An orderly close reads as b""; pending bytes mean it is still there
+        return sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b""
+    except (BlockingIOError, InterruptedError):
+        return False
+    except OSError:
+        return True
+
+
+class CancelToken:
+    def __init__(self, route, environ=None, timeout=None):
+        self.route = route
+        self.environ = environ or {}
+        self.deadline = time.monotonic() + timeout if timeout else None
+
+    def cancelled(self):
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            return True
+        return client_gone(self.environ)
+
+
+@contextmanager
+def cancel_scope(token):
+    reset = _token.set(token)
+    try:
+        yield token
+    finally:
+        _token.reset(reset)
+
+
+def checkpoint():
+    """Raise Cancelled if the current request is no longer wanted."""
+    token = _token.get()
+    if token is not None and token.cancelled():
+        metrics.inc("requests_cancelled_total", route=token.route)
+        raise Cancelled(f"{token.route} request abandoned")
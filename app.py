@@ -1,70 +1,439 @@
-from flask import Flask, render_template, request, jsonify
-from repo import get_repo
-from tutor import MarkdownTutor
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Nothing heavy is imported here: LangChain, Chroma, OpenAI and PyGithub load
+# on first use (jobs, tutors), so the homepage and /health come up at once.
+# Check with: python -m benchmarks.importtime
+from flask import Flask, Response, g, render_template, request, jsonify
+from channels import Hub
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from jobs import JobQueue
+from repo import repo_path
+from store import open_store
+from sessions import SessionCache
+from resilience import Unavailable
+import admission
+import diagnostics
+import functools
+import hashlib
+import hmac
+import metrics
+import os
+import threading
+import time
+import uuid
+
+diagnostics.start_tracing()
 
 app = Flask(__name__)
 
 active_tutors = {}
 
+# Shared with the other app workers: lessons, courses, jobs and sessions
+store = open_store()
+rehydrate_lock = threading.Lock()
+
+# Session writes are batched in the background, off the request path
+sessions = SessionCache(store, float(os.getenv("SESSION_FLUSH_INTERVAL", "0.5")))
+
+# Tutors are built by background jobs, never inside a request
+jobs = JobQueue(
+    active_tutors,
+    store,
+    workers=int(os.getenv("JOB_WORKERS", "2")),
+    processes=int(os.getenv("JOB_PROCESSES", "0")),
+)
+
+
+# Bounded concurrency and queueing for the routes that call the model
+gates = {
+    route: admission.Gate(
+        route,
+        concurrency=int(os.getenv(f"ADMIT_{route.upper()}_CONCURRENCY", "16")),
+        queue=int(os.getenv(f"ADMIT_{route.upper()}_QUEUE", "64")),
+        max_wait=float(os.getenv(f"ADMIT_{route.upper()}_MAX_WAIT", "10")),
+    )
+    for route in ("ask", "quiz")
+}
+session_limit = admission.SessionLimit(int(os.getenv("SESSION_CONCURRENCY", "2")))
+REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT", "120"))
+
+
+@contextmanager
+def admit(route):
+    """Wait for capacity on a route, cancelling the work if the client leaves."""
+    token = admission.CancelToken(route, request.environ, REQUEST_TIMEOUT)
+    with admission.cancel_scope(token), session_limit.hold(g.sid), gates[route].enter():
+        yield
+
+
+def admitted(route):
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            with admit(route):
+                return view(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def get_tutor(name):
+    """This worker's tutor for a lesson, rebuilt from the shared store if needed."""
+    tutor = active_tutors.get(name)
+    if tutor:
+        return tutor
+
+    with rehydrate_lock:
+        return active_tutors.get(name) or jobs.load_lesson(name)
+
+
+def load_session(name):
+    from tutor import new_session
+
+    return sessions.get(f"session:{g.sid}:{name}", new_session)
+
+
+def save_session(name, session):
+    sessions.put(f"session:{g.sid}:{name}", session)
+
+
+def save_caches(tutor):
+    """Share newly cached answers/quizzes with the other workers.
+
+    The write goes through the session write-behind thread, so it costs
+    the request no store round trip and a burst of new answers is
+    written once per flush.
+    """
+    if tutor.caches_changed:
+        tutor.caches_changed = False
+        sessions.put(f"cache:{tutor.name}", tutor.caches())
+
+
+# Event stream channels for the tutor page, off unless CHANNELS=1 (see channels.py)
+CHANNELS = os.getenv("CHANNELS", "0") == "1"
+hub = Hub()
+prefetcher = ThreadPoolExecutor(max_workers=2, thread_name_prefix="prefetch")
+
+
+def prefetch_quiz(tutor, num_questions):
+    """A quiz made ahead for one student, as the session state it starts."""
+    from tutor import new_session
+
+    session = new_session()
+    tutor.generate_quiz(num_questions, session=session)
+    save_caches(tutor)
+    return session["quiz"]
+
+
+def load_bundles():
+    """Serve courses from offline bundles listed in COURSE_BUNDLES."""
+    for bundle_file in filter(None, os.getenv("COURSE_BUNDLES", "").split(",")):
+        from bundle import load_bundle
+
+        path, tutors = load_bundle(bundle_file.strip())
+        for tutor in tutors:
+            active_tutors[tutor.name] = tutor
+
+
+# Courses listed in WARMUP_COURSES are built as soon as the app is imported
+warmup_jobs = {}
+
+
+def start_warmup():
+    for url in filter(None, os.getenv("WARMUP_COURSES", "").split(",")):
+        path = repo_path(url)
+        warmup_jobs[path] = jobs.submit(path)
+
+
+load_bundles()
+start_warmup()
+
+
+@app.before_request
+def start_timer():
+    g.start = time.perf_counter()
+    g.sid = request.cookies.get("sid")
+    g.new_sid = not g.sid
+    if g.new_sid:
+        g.sid = uuid.uuid4().hex
+
+
+@app.after_request
+def record_request(response):
+    if g.get("new_sid"):
+        response.set_cookie(
+            "sid", g.sid, max_age=30 * 24 * 3600, httponly=True, samesite="Lax"
+        )
+    if "start" in g:
+        metrics.observe(
+            "http_request_seconds",
+            time.perf_counter() - g.start,
+            endpoint=request.endpoint or "unknown",
+            status=response.status_code,
+        )
+    return response
+
+
+@app.errorhandler(Unavailable)
+def model_unavailable(e):
+    """The model provider is failing and there was nothing cached to serve."""
+    response = jsonify({"error": "The tutor is temporarily unavailable, please try again."})
+    response.status_code = 503
+    response.headers["Retry-After"] = str(max(1, round(e.retry_after or 0)))
+    return response
+
+
+@app.errorhandler(admission.Shed)
+def shed(e):
+    response = jsonify({"error": str(e)})
+    response.status_code = 429
+    response.headers["Retry-After"] = str(e.retry_after)
+    return response
+
+
+@app.errorhandler(admission.Cancelled)
+def cancelled(e):
+    # Nobody is listening; 499 is the usual "client closed request" code
+    return jsonify({"error": str(e)}), 499
+
+
+@app.route("/metrics")
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+def debug_allowed():
+    """Debug endpoints are off without DEBUG_TOKEN, and need it as a bearer token."""
+    expected = os.getenv("DEBUG_TOKEN")
+    supplied = request.headers.get("Authorization", "").removeprefix("Bearer ")
+    return bool(expected) and hmac.compare_digest(supplied.encode(), expected.encode())
+
+
+def live_sessions():
+    """(session id, lesson, state) for the student sessions held in memory."""
+    # Sessions wait in the cache until they are written to the store
+    seen = set()
+    for key, state in dict(sessions.pending).items():
+        if not key.startswith("session:"):
+            continue  # a tutor's caches waiting to be written
+        _, sid, lesson = key.split(":", 2)
+        seen.add(id(state))
+        yield sid, lesson, state
+    for channel in list(hub.channels.values()):
+        for panel in dict(channel.panels).values():
+            if id(panel.session) not in seen:  # an open panel's session is often pending too
+                yield channel.sid, panel.name, panel.session
+
+
+@app.route("/debug/memory")
+def memory():
+    if not debug_allowed():
+        return jsonify({"error": "Not found"}), 404
+    limit = request.args.get("limit", 10, type=int)
+    return jsonify(diagnostics.memory_report(active_tutors, limit, live_sessions()))
+
 
 @app.route("/")
 def homepage():
     return render_template("home.html")
 
 
+@app.route("/health")
+def health():
+    """Readiness of the warm-up; 503 until every configured course is built.
+
+    A course whose build failed keeps the worker unready, so it is not
+    put into rotation without the lessons it is meant to serve.
+    """
+    ready = all(job.status == "ready" for job in warmup_jobs.values())
+    body = {
+        "ready": ready,
+        "failed": [path for path, job in warmup_jobs.items() if job.status == "failed"],
+        "tutors": len(active_tutors),
+        "courses": {path: job.to_dict() for path, job in warmup_jobs.items()},
+    }
+    return jsonify(body), 200 if ready else 503
+
+
 @app.route("/tutor")
 def tutor():
-    path = request.args.get("path")
-    parts = path.split("/")
-    result = "/".join(parts[3:5])
+    path = repo_path(request.args.get("path"))
+
+    # Serve whatever is already built; the page polls the job for the rest
+    job = jobs.submit(path)
+    course = store.get(f"course:{path}") or {"lessons": []}
+    lessons = [n for n, state in job.lessons.items() if state == "ready"]
+    lessons = lessons or course["lessons"]
+
+    return render_template("tutor.html", lessons=lessons, job=job, channels=CHANNELS)
 
-    repo = get_repo(result)
 
-    tutors = []
-    for name, markdown_text in repo.items():
-        tutor = MarkdownTutor(markdown_text, name)
-        tutors.append(tutor)
-        active_tutors[name] = tutor
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    status = jobs.status(job_id)
+    if not status:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(status)
 
-    return render_template("tutor.html", tutors=tutors)
+
+@app.route("/refresh", methods=["POST"])
+def refresh():
+    """Re-sync a course in the background, e.g. from a GitHub push webhook."""
+    secret = os.getenv("GITHUB_WEBHOOK_SECRET")
+    if secret:
+        expected = "sha256=" + hmac.new(
+            secret.encode(), request.get_data(), hashlib.sha256
+        ).hexdigest()
+        signature = request.headers.get("X-Hub-Signature-256", "")
+        if not hmac.compare_digest(expected, signature):
+            return jsonify({"error": "Invalid signature"}), 403
+
+    data = request.get_json(silent=True) or {}
+    path = request.args.get("path") or data.get("repository", {}).get("full_name")
+    if not path:
+        return jsonify({"error": "No repository given"}), 400
+
+    # Push events name the new commit, so a build of an older one is not reused
+    job = jobs.submit(repo_path(path), data.get("after"))
+    return jsonify({"refreshing": job.path, "job": job.id}), 202
 
 
 @app.route("/ask", methods=["POST"])
+@admitted("ask")
 def ask():
     data = request.get_json()
     name = data["name"]
     question = data["question"]
-    tutor = active_tutors.get(name)
+    tutor = get_tutor(name)
 
     if not tutor:
         return jsonify({"error": "Tutor not found"}), 404
 
-    answer = tutor.ask(question)
+    session = load_session(name)
+    answer = tutor.ask(question, session)
+    save_session(name, session)
+    save_caches(tutor)
     return jsonify({"answer": answer})
 
 
 @app.route("/quiz", methods=["POST"])
+@admitted("quiz")
 def quiz():
     data = request.get_json()
     name = data["name"]
     action = data.get("action", "start")
     answer = data.get("answer")
 
-    tutor = active_tutors.get(name)
+    tutor = get_tutor(name)
     if not tutor:
         return jsonify({"error": "Tutor not found"}), 404
 
+    session = load_session(name)
     if action == "start":
-        quiz = tutor.generate_quiz()
-        question = tutor.ask_quiz_question()
+        quiz = tutor.generate_quiz(session=session)
+        question = tutor.ask_quiz_question(session)
+        save_session(name, session)
+        save_caches(tutor)
         return jsonify({"question": question})
     elif action == "answer":
-        feedback = tutor.answer_quiz(answer)
-        next_q = tutor.ask_quiz_question()
+        feedback = tutor.answer_quiz(answer, session)
+        next_q = tutor.ask_quiz_question(session)
+        save_session(name, session)
         return jsonify({"feedback": feedback, "next": next_q})
     else:
         return jsonify({"error": "Invalid quiz action"}), 400
 
 
+@app.route("/channel")
+def channel_open():
+    """The page's event stream for all of its tutor panels; see channels.py."""
+    if not CHANNELS:
+        return jsonify({"error": "Channels are disabled"}), 404
+    return Response(
+        hub.serve(hub.open(g.sid)),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def open_panel(channel, name):
+    panel = channel.panels.get(name)
+    if panel:
+        return panel
+    tutor = get_tutor(name)
+    return tutor and channel.open_panel(name, tutor, load_session(name))
+
+
+def take_prefetched(panel, num_questions):
+    """The quiz prefetched for a panel, if it is the size asked for; used once."""
+    prepared, panel.quiz = panel.quiz, None
+    if prepared is None or prepared[0] != num_questions:
+        return None
+    try:
+        return prepared[1].result()
+    except Exception:
+        return None  # generate one now instead
+
+
+@app.route("/channel/<channel_id>/command", methods=["POST"])
+def channel_command(channel_id):
+    """Run a panel command; the results arrive on the channel's stream."""
+    channel = hub.get(channel_id, g.sid)
+    if not channel:
+        return jsonify({"error": "Channel not found"}), 410
+
+    data = request.get_json()
+    kind = data.get("type")
+    name = data.get("lesson")
+    if kind not in ("open", "close", "ask", "quiz_start", "quiz_answer") or not name:
+        return jsonify({"error": "Invalid command"}), 400
+
+    if kind == "close":
+        channel.close_panel(name)
+        return "", 204
+
+    panel = open_panel(channel, name)
+    if not panel:
+        return jsonify({"error": "Tutor not found"}), 404
+    if kind == "open":
+        if data.get("mode") == "quiz" and panel.quiz is None:
+            # Have this student's quiz ready by the time they press Start
+            panel.quiz = (5, prefetcher.submit(prefetch_quiz, panel.tutor, 5))
+        return "", 204
+
+    tutor, session = panel.tutor, panel.session
+    send = functools.partial(channel.send, lesson=name)
+    with admit("ask" if kind == "ask" else "quiz"), panel.lock:
+        if kind == "ask":
+
+            def on_token(text):
+                if text is None:
+                    send("reset")
+                else:
+                    send("token", text=text)
+
+            answer = tutor.ask(data["question"], session, on_token=on_token)
+            send("answer", text=answer)
+        elif kind == "quiz_start":
+            num_questions = min(20, max(1, int(data.get("num_questions") or 5)))
+            session["quiz"] = take_prefetched(panel, num_questions)
+            if session["quiz"] is None:
+                tutor.generate_quiz(num_questions, session=session)
+            send("question", text=tutor.ask_quiz_question(session))
+        else:
+            send("feedback", text=tutor.answer_quiz(data["answer"], session))
+            send("question", text=tutor.ask_quiz_question(session))
+        save_session(name, session)
+        save_caches(tutor)
+    return "", 204
+
+
 if __name__ == "__main__":
+    if os.getenv("WARMUP_BLOCKING"):
+        for job in warmup_jobs.values():
+            job.wait()
     app.run(debug=True, port=3000)
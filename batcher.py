@@ -0,0 +1,118 @@
+"""Course-wide embedding batching.
+
+Instead of one embedding call per lesson, all chunks of the lessons being
+built are packed into as few requests as the API limits allow (by input
+count and token count), a bounded number of requests run at once, and a
+failed request is retried on its own without redoing the rest. Each
+lesson is reported as soon as all of its chunks have vectors, so the
+first lessons become usable before the whole course is embedded.
+"""
+
+import os
+import random
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import metrics
+
+# OpenAI allows 2048 inputs and 300k tokens per embeddings request
+MAX_INPUTS = int(os.getenv("EMBED_BATCH_INPUTS", "2048"))
+MAX_TOKENS = int(os.getenv("EMBED_BATCH_TOKENS", "250000"))
+IN_FLIGHT = int(os.getenv("EMBED_IN_FLIGHT", "4"))
+
+try:
+    import tiktoken
+
+    _encoding = tiktoken.get_encoding("cl100k_base")
+
+    def count_tokens(text):
+        return len(_encoding.encode(text, disallowed_special=()))
+
+except ImportError:
+
+    def count_tokens(text):
+        return len(text) // 4 + 1
+
+
+def pack(items, max_inputs=MAX_INPUTS, max_tokens=MAX_TOKENS):
+    """Split [(id, text)] into batches that fit one request each, in order."""
+    batches = []
+    batch, tokens = [], 0
+    for item in items:
+        n = count_tokens(item[1])
+        if batch and (len(batch) >= max_inputs or tokens + n > max_tokens):
+            batches.append(batch)
+            batch, tokens = [], 0
+        batch.append(item)
+        tokens += n
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+class EmbeddingBatcher:
+    def __init__(self, embeddings, in_flight=IN_FLIGHT, retries=3, backoff=1.0):
+        self.embeddings = embeddings
+        self.in_flight = in_flight
+        self.retries = retries
+        self.backoff = backoff
+
+    def _embed_batch(self, batch):
+        for attempt in range(self.retries + 1):
+            try:
+                vectors = self.embeddings.embed_documents([text for _, text in batch])
+                metrics.inc("embedding_requests_total")
+                metrics.inc("embedding_inputs_total", len(batch))
+                return vectors
+            except Exception:
+                if attempt == self.retries:
+                    raise
+                metrics.inc("embedding_request_retries_total")
+                time.sleep(self.backoff * 2**attempt * random.uniform(0.5, 1.5))
+
+    def embed_groups(self, groups, on_done, on_error):
+        """Embed {group: {chunk id: text}} as a whole.
+
+        Calls on_done(group, {chunk id: vector}) once every chunk of a group
+        is embedded, or on_error(group, exception) if one of its batches
+        fails. Chunks shared by several groups are embedded once.
+        """
+        texts = {}
+        owners = defaultdict(set)
+        for group, chunks in groups.items():
+            for cid, text in chunks.items():
+                texts[cid] = text
+                owners[cid].add(group)
+
+        remaining = {group: set(chunks) for group, chunks in groups.items()}
+        for group in [g for g, left in remaining.items() if not left]:
+            del remaining[group]
+            on_done(group, {})
+
+        vectors = {}
+        batches = pack(list(texts.items()))
+        with ThreadPoolExecutor(max_workers=self.in_flight) as pool:
+            futures = {pool.submit(self._embed_batch, batch): batch for batch in batches}
+            for future in as_completed(futures):
+                batch = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    for cid, _ in batch:
+                        for group in owners[cid]:
+                            if remaining.pop(group, None) is not None:
+                                on_error(group, e)
+                    continue
+
+                for (cid, _), vector in zip(batch, result):
+                    vectors[cid] = vector
+                    for group in owners[cid]:
+                        left = remaining.get(group)
+                        if left is None:
+                            continue
+                        left.discard(cid)
+                        if not left:
+                            del remaining[group]
+                            on_done(group, {c: vectors[c] for c in groups[group]})
+
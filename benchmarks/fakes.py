@@ -0,0 +1,119 @@
+"""Deterministic stand-ins for the OpenAI chat and embedding models.
+
+Selected with MODEL_BACKEND=benchmarks.fakes. Latency is configurable
+through the environment so process-pool workers see the same settings:
+
+    FAKE_CHAT_LATENCY    seconds per chat call (default 0.2)
+    FAKE_EMBED_LATENCY   seconds per embedding request (default 0.05)
+    FAKE_EMBED_PER_TEXT  extra seconds per embedded text (default 0.001)
+"""
+
+import hashlib
+import json
+import math
+import os
+import re
+import time
+from typing import List
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+DIMENSIONS = 256
+WORD = re.compile(r"[a-z0-9]+")
+
+
+def _latency(name, default):
+    return float(os.getenv(name, default))
+
+
+def _tokens(text):
+    # Close enough to tiktoken for English prose and markdown
+    return max(1, len(text) // 4)
+
+
+class FakeChatModel(BaseChatModel):
+    """Answers every tutor prompt with plausible, deterministic output."""
+
+    model_name: str = "fake-chat"
+    temperature: float = 0.0
+    latency: float = 0.2
+
+    @property
+    def _llm_type(self):
+        return "fake-chat"
+
+    def _reply(self, prompt):
+        if "strict JSON" in prompt:
+            match = re.search(r"generate (\d+) quiz questions", prompt)
+            count = int(match.group(1)) if match else 5
+            return json.dumps(
+                [
+                    {
+                        "question": f"Sample question {i + 1}?",
+                        "options": ["First", "Second", "Third", "Fourth"],
+                        "answer": "Second",
+                    }
+                    for i in range(count)
+                ]
+            )
+        if "Reply only 'Yes' or 'No'" in prompt:
+            return "Yes"
+        if "Rewrite this question" in prompt:
+            match = re.search(r"User question: (.*)", prompt)
+            return match.group(1) if match else prompt[-200:]
+        return "Here is what the lesson says: " + " ".join(prompt.split()[:60])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency)
+        prompt = "\n".join(str(m.content) for m in messages)
+        text = self._reply(prompt)
+        usage = {
+            "input_tokens": _tokens(prompt),
+            "output_tokens": _tokens(text),
+            "total_tokens": _tokens(prompt) + _tokens(text),
+        }
+        message = AIMessage(content=text, usage_metadata=usage)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+
+class FakeEmbeddings(Embeddings):
+    """Hashed bag-of-words vectors, so similar texts really are close."""
+
+    def __init__(self, latency=0.05, per_text=0.001):
+        self.latency = latency
+        self.per_text = per_text
+        self.calls = 0
+
+    def _vector(self, text):
+        vector = [0.0] * DIMENSIONS
+        for word in WORD.findall(text.lower()):
+            h = int.from_bytes(hashlib.md5(word.encode()).digest()[:4], "little")
+            vector[h % DIMENSIONS] += 1.0
+        norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+        return [x / norm for x in vector]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        time.sleep(self.latency + self.per_text * len(texts))
+        return [self._vector(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+def chat_model(**kwargs):
+    return FakeChatModel(
+        model_name=kwargs.get("model", "fake-chat"),
+        temperature=kwargs.get("temperature", 0.0),
+        latency=_latency("FAKE_CHAT_LATENCY", 0.2),
+    )
+
+
+def embeddings():
+    return FakeEmbeddings(
+        latency=_latency("FAKE_EMBED_LATENCY", 0.05),
+        per_text=_latency("FAKE_EMBED_PER_TEXT", 0.001),
+    )
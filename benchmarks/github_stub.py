@@ -0,0 +1,165 @@
+"""A local stand-in for the parts of the GitHub API that repo.py uses.
+
+Serves one synthetic course per owner/name on a background thread. Point
+the app at it with GITHUB_API_URL=<stub.url>.
+"""
+
+import base64
+import hashlib
+import json
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+TOPICS = [
+    "HTML", "CSS", "selectors", "flexbox", "grid", "forms", "JavaScript",
+    "events", "the DOM", "functions", "arrays", "objects", "fetch", "promises",
+    "accessibility", "responsive design", "media queries", "deployment",
+]
+
+
+def make_lesson(index, sections=12, seed=0):
+    """A lesson shaped like the real ones: objectives, sections, code, boilerplate."""
+    rng = random.Random(seed * 1000 + index)
+    topic = TOPICS[index % len(TOPICS)]
+    parts = [f"# Lesson {index + 1}: {topic}", "", "## Learning Objectives", ""]
+    parts += [f"1. Explain {rng.choice(TOPICS)} in the context of {topic}" for _ in range(4)]
+    for s in range(sections):
+        subject = rng.choice(TOPICS)
+        parts += ["", f"## {subject.title()} part {s + 1}", ""]
+        for _ in range(3):
+            words = [rng.choice(TOPICS + ["the", "and", "with", "uses", "page"]) for _ in range(40)]
+            parts.append(" ".join(words).capitalize() + ".")
+        parts += ["", "```html", f"<section class=\"{subject}\"><h2>{topic}</h2></section>", "```"]
+    parts += ["", "## BREAK", "", "## Lab", "", "Work on your homework with a partner."]
+    return "\n".join(parts)
+
+
+def make_readme(lessons):
+    """A README whose schedule links each lesson, a lab and an outside page."""
+    rows = [
+        f"| {i + 1} | [{TOPICS[i % len(TOPICS)]}](Lessons/Lesson{i + 1:02d}.md) "
+        f"| [Lab](Labs/Lab{i + 1:02d}.md) | https://developer.mozilla.org/ |"
+        for i in range(lessons)
+    ]
+    return "\n".join(
+        ["# Course", "", "## Schedule", "", "| Class | Topics | Lab | Reading |", "|---|---|---|---|"]
+        + rows
+        + ["", "## Evaluation", "", "Lessons not in the schedule are not part of the course."]
+    )
+
+
+def make_course(lessons=10, sections=12, seed=0):
+    files = {f"Lessons/Lesson{i + 1:02d}.md": make_lesson(i, sections, seed) for i in range(lessons)}
+    files["Lessons/Archive.md"] = make_lesson(lessons, sections, seed)  # not scheduled
+    files["README.md"] = make_readme(lessons)
+    return files
+
+
+def _sha(text):
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+class GitHubStub:
+    def __init__(self, courses, port=0):
+        self.courses = courses  # "owner/name" -> {path: markdown}
+        self.requests = 0
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+    def head(self, repo):
+        files = self.courses[repo]
+        return _sha("".join(f"{p}:{_sha(t)}" for p, t in sorted(files.items())))
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def send(self, status, body=b"", headers=None):
+                self.send_response(status)
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def send_json(self, data):
+                self.send(200, json.dumps(data).encode(), {"Content-Type": "application/json"})
+
+            def do_GET(self):
+                stub.requests += 1
+                url = urlparse(self.path)
+                parts = url.path.strip("/").split("/")
+                if len(parts) < 4 or parts[0] != "repos":
+                    return self.send(404)
+
+                repo = "/".join(parts[1:3])
+                if repo not in stub.courses:
+                    return self.send(404)
+                files = stub.courses[repo]
+                head = stub.head(repo)
+
+                if parts[3] == "commits":
+                    etag = f'"{head}"'
+                    if self.headers.get("If-None-Match") == etag:
+                        return self.send(304, headers={"ETag": etag})
+                    return self.send(200, head.encode(), {"ETag": etag})
+
+                if parts[3] != "contents":
+                    return self.send(404)
+
+                path = "/".join(parts[4:])
+                ref = parse_qs(url.query).get("ref", [head])[0]
+                base = f"{stub.url}/repos/{repo}/contents"
+
+                if path in files:
+                    text = files[path]
+                    return self.send_json(
+                        {
+                            "type": "file",
+                            "name": path.rsplit("/", 1)[-1],
+                            "path": path,
+                            "sha": _sha(text),
+                            "size": len(text),
+                            "encoding": "base64",
+                            "content": base64.b64encode(text.encode()).decode(),
+                            "url": f"{base}/{path}?ref={ref}",
+                        }
+                    )
+
+                prefix = path + "/"
+                children = {}
+                for file_path in files:
+                    if file_path.startswith(prefix):
+                        rest = file_path[len(prefix):].split("/")
+                        child = prefix + rest[0]
+                        children[child] = "file" if len(rest) == 1 else "dir"
+                if not children:
+                    return self.send(404)
+
+                return self.send_json(
+                    [
+                        {
+                            "type": kind,
+                            "name": child.rsplit("/", 1)[-1],
+                            "path": child,
+                            "sha": _sha(files[child]) if kind == "file" else _sha(child),
+                            "size": len(files[child]) if kind == "file" else 0,
+                            "url": f"{base}/{child}?ref={ref}",
+                        }
+                        for child, kind in sorted(children.items())
+                    ]
+                )
+
+        return Handler
@@ -0,0 +1,111 @@
+"""Check that the app starts fast and without loading the ML stack.
+
+Imports app.py in a fresh interpreter under `python -X importtime`,
+reports the total and the slowest modules, then serves / and /health in
+another fresh interpreter and checks that none of the heavy packages
+were imported along the way. Fails if the import exceeds --budget or a
+heavy package shows up.
+
+    python -m benchmarks.importtime
+    python -m benchmarks.importtime --budget 0.5 --top 15
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Packages that must only load once a tutor is actually built or used
+HEAVY = (
+    "langchain",
+    "langchain_community",
+    "langchain_openai",
+    "chromadb",
+    "openai",
+    "github",
+    "numpy",
+    "tiktoken",
+)
+
+SERVE = """
+import json, sys
+import app
+client = app.app.test_client()
+statuses = {path: client.get(path).status_code for path in ("/", "/health")}
+loaded = sorted({name.split(".")[0] for name in sys.modules})
+print(json.dumps({"statuses": statuses, "loaded": loaded}))
+"""
+
+
+def env():
+    # Same isolation as benchmarks.run: no store file, no warm-up, no network
+    return {
+        **os.environ,
+        "TUTOR_STORE": "memory://",
+        "WARMUP_COURSES": "",
+        "COURSE_BUNDLES": "",
+        "TRACEMALLOC": "",
+    }
+
+
+def import_times():
+    """{module: (self µs, cumulative µs)} for `import app`, from -X importtime."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app"],
+        cwd=ROOT,
+        env=env(),
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode:
+        raise SystemExit(result.stderr)
+
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        if own.strip().isdigit():
+            times[name.strip()] = (int(own), int(cumulative))
+    return times
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--budget", type=float, default=1.0, help="seconds to import app")
+    parser.add_argument("--top", type=int, default=10, help="slowest modules to list")
+    args = parser.parse_args(argv)
+
+    times = import_times()
+    total = times["app"][1] / 1e6
+    print(f"import app: {total:.3f}s (budget {args.budget:.3f}s)")
+    for name, (own, _) in sorted(times.items(), key=lambda t: -t[1][0])[: args.top]:
+        print(f"  {own / 1e3:8.1f} ms  {name}")
+
+    result = subprocess.run(
+        [sys.executable, "-c", SERVE], cwd=ROOT, env=env(), capture_output=True, text=True
+    )
+    if result.returncode:
+        raise SystemExit(result.stderr)
+    served = json.loads(result.stdout.strip().splitlines()[-1])
+    print(f"\nServed without building: {served['statuses']}")
+    heavy = [name for name in HEAVY if name in served["loaded"]]
+
+    failed = False
+    if total > args.budget:
+        print(f"FAIL: import took {total:.3f}s, over the {args.budget:.3f}s budget")
+        failed = True
+    if heavy:
+        print(f"FAIL: heavy packages imported at startup: {', '.join(heavy)}")
+        failed = True
+    if not failed:
+        print("OK: within budget, no heavy packages loaded")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
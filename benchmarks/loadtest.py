@@ -0,0 +1,223 @@
+"""Simulate a classroom of students hitting the app at once.
+
+Each simulated student opens the course, waits for its lessons, asks a
+few questions, then takes a quiz and answers every question, pausing for
+a random think time between actions. Students arrive spread over
+--ramp seconds.
+
+By default the app runs in-process against fake models and the GitHub
+stub (fully offline). Pass --url to drive a running server instead.
+
+    python -m benchmarks.loadtest --students 60 --ramp 30
+    python -m benchmarks.loadtest --url http://localhost:3000 --course owner/repo
+"""
+
+import argparse
+import http.cookiejar
+import json
+import random
+import re
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+import urllib.error
+import urllib.request
+from argparse import Namespace
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.run import COURSE, percentile, setup
+
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30)
+JOB_ID = re.compile(r'const jobId = "(\w+)"')
+
+
+class InProcessClient:
+    def __init__(self, flask_app):
+        self.client = flask_app.test_client()
+
+    def request(self, method, path, body=None):
+        resp = self.client.open(path, method=method, json=body)
+        return resp.status_code, resp.get_data(as_text=True)
+
+
+class HttpClient:
+    def __init__(self, url, timeout=120):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        # Keep the session cookie, like a browser would
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar())
+        )
+
+    def request(self, method, path, body=None):
+        data = json.dumps(body).encode() if body is not None else None
+        req = urllib.request.Request(
+            self.url + path,
+            data=data,
+            method=method,
+            headers={"Content-Type": "application/json"} if data else {},
+        )
+        try:
+            with self.opener.open(req, timeout=self.timeout) as resp:
+                return resp.status, resp.read().decode()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read().decode()
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def call(self, client, route, method, path, body=None):
+        start = time.perf_counter()
+        try:
+            status, text = client.request(method, path, body)
+        except Exception:
+            status, text = 0, ""
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self.latencies[route].append(elapsed)
+            if status >= 400 or status == 0:
+                self.errors[route] += 1
+        return status, text
+
+
+def student(make_client, recorder, args, seed):
+    rng = random.Random(seed)
+    client = make_client()  # one cookie jar, and so one session, per student
+
+    def think():
+        time.sleep(rng.uniform(0, 2 * args.think))
+
+    status, page = recorder.call(client, "tutor", "GET", f"/tutor?path={args.course}")
+    match = JOB_ID.search(page)
+    if not match:
+        return
+
+    # Wait for the course like the page does, polling the build job
+    lessons = []
+    deadline = time.time() + args.build_timeout
+    while time.time() < deadline:
+        status, text = recorder.call(client, "jobs", "GET", f"/jobs/{match.group(1)}")
+        job = json.loads(text) if status == 200 else {}
+        lessons = [n for n, state in job.get("lessons", {}).items() if state == "ready"]
+        if job.get("status") in ("ready", "failed"):
+            break
+        time.sleep(1)
+    if not lessons:
+        return
+
+    name = rng.choice(lessons)
+    for i in range(args.questions):
+        think()
+        question = f"Can you explain part {rng.randint(1, 12)} of {name}?"
+        recorder.call(client, "ask", "POST", "/ask", {"name": name, "question": question})
+
+    think()
+    status, text = recorder.call(
+        client, "quiz_start", "POST", "/quiz", {"name": name, "action": "start"}
+    )
+    for _ in range(args.quiz_answers):
+        think()
+        status, text = recorder.call(
+            client,
+            "quiz_answer",
+            "POST",
+            "/quiz",
+            {"name": name, "action": "answer", "answer": rng.choice("ABCD")},
+        )
+        if status != 200 or not json.loads(text).get("next"):
+            break
+
+
+def histogram(latencies):
+    counts = [sum(1 for x in latencies if x <= b) for b in BUCKETS]
+    lines = []
+    previous = 0
+    for bound, count in zip(BUCKETS, counts):
+        n = count - previous
+        previous = count
+        lines.append(f"    <= {bound:>5}s {n:>6} {'#' * min(60, n)}")
+    rest = len(latencies) - previous
+    lines.append(f"    >  {BUCKETS[-1]:>5}s {rest:>6} {'#' * min(60, rest)}")
+    return "\n".join(lines)
+
+
+def rss_mb():
+    # ru_maxrss is KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--students", type=int, default=30)
+    parser.add_argument("--ramp", type=float, default=10, help="seconds over which students arrive")
+    parser.add_argument("--think", type=float, default=1.0, help="mean think time in seconds")
+    parser.add_argument("--questions", type=int, default=3)
+    parser.add_argument("--quiz-answers", type=int, default=5)
+    parser.add_argument("--build-timeout", type=float, default=300)
+    parser.add_argument("--url", help="drive a running server instead of an in-process app")
+    parser.add_argument("--course", default=COURSE)
+    parser.add_argument("--lessons", type=int, default=10)
+    parser.add_argument("--sections", type=int, default=12)
+    parser.add_argument("--chat-latency", type=float, default=0.5)
+    parser.add_argument("--embed-latency", type=float, default=0.05)
+    args = parser.parse_args(argv)
+
+    stub = None
+    if args.url:
+        make_client = lambda: HttpClient(args.url)
+    else:
+        tracemalloc.start()
+        stub, app = setup(
+            Namespace(
+                lessons=args.lessons,
+                sections=args.sections,
+                chat_latency=args.chat_latency,
+                embed_latency=args.embed_latency,
+            )
+        )
+        make_client = lambda: InProcessClient(app.app)
+
+    recorder = Recorder()
+    rss_before = rss_mb()
+    heap_before = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.students) as pool:
+        for i in range(args.students):
+            pool.submit(student, make_client, recorder, args, i)
+            time.sleep(args.ramp / args.students)
+    elapsed = time.perf_counter() - start
+
+    total = sum(len(v) for v in recorder.latencies.values())
+    errors = sum(recorder.errors.values())
+    print(f"\n{args.students} students, {total} requests in {elapsed:.1f}s")
+    print(f"Throughput: {total / elapsed:.2f} req/s, errors: {errors} ({errors / max(total, 1):.1%})")
+
+    for route, latencies in sorted(recorder.latencies.items()):
+        print(
+            f"\n  {route}: n={len(latencies)} errors={recorder.errors[route]}"
+            f" p50={percentile(latencies, 50):.3f}s"
+            f" p95={percentile(latencies, 95):.3f}s"
+            f" p99={percentile(latencies, 99):.3f}s"
+        )
+        print(histogram(latencies))
+
+    print(f"\nPeak RSS: {rss_before:.0f} MB -> {rss_mb():.0f} MB")
+    if tracemalloc.is_tracing():
+        heap_after = tracemalloc.get_traced_memory()[0]
+        print(f"Python heap growth: {(heap_after - heap_before) / 2**20:.1f} MB")
+
+    if stub:
+        stub.stop()
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,227 @@
+"""Offline benchmark of tutor building, /ask and quiz generation.
+
+Runs the real app against fake models (benchmarks/fakes.py) and a local
+GitHub stub, so it needs no network and costs nothing. Results are
+compared with benchmarks/baseline.json; a metric that is worse than the
+baseline by more than --tolerance fails the run.
+
+    python -m benchmarks.run                  # run and compare
+    python -m benchmarks.run --save-baseline  # record a new baseline
+"""
+
+import argparse
+import itertools
+import json
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from benchmarks.github_stub import GitHubStub, make_course
+
+BASELINE = Path(__file__).with_name("baseline.json")
+COURSE = "bench/course"
+
+# Metrics where a larger number is better; everything else is a cost
+HIGHER_IS_BETTER = {"max_sessions", "context_recall"}
+
+# Every question is new, so /ask never hits the answer cache
+_question_ids = itertools.count()
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def setup(args):
+    """Start the GitHub stub and import the app wired to the fakes."""
+    stub = GitHubStub({COURSE: make_course(args.lessons, args.sections)}).start()
+    os.environ["GITHUB_API_URL"] = stub.url
+    os.environ["MODEL_BACKEND"] = "benchmarks.fakes"
+    os.environ["TUTOR_STORE"] = "memory://"
+    os.environ["FAKE_CHAT_LATENCY"] = str(args.chat_latency)
+    os.environ["FAKE_EMBED_LATENCY"] = str(args.embed_latency)
+    os.environ.pop("WARMUP_COURSES", None)
+    os.environ.pop("COURSE_BUNDLES", None)
+
+    import app
+
+    return stub, app
+
+
+def bench_build(app):
+    start = time.perf_counter()
+    job = app.jobs.submit(COURSE)
+    job.wait()
+    elapsed = time.perf_counter() - start
+    if job.status != "ready":
+        raise RuntimeError(f"Build failed: {job.error}")
+    return elapsed, list(job.lessons)
+
+
+def ask_latencies(flask_app, names, count, concurrency=1):
+    def one(i):
+        name = names[i % len(names)]
+        question = f"What is item {next(_question_ids)}?"
+        client = flask_app.test_client()  # a fresh student session per request
+        start = time.perf_counter()
+        resp = client.post("/ask", json={"name": name, "question": question})
+        elapsed = time.perf_counter() - start
+        return elapsed if resp.status_code == 200 else None
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(count)))
+    return [r for r in results if r is not None], results.count(None)
+
+
+def bench_context(app, names, count, seed=0):
+    """Share of questions whose source sentence survives into the prompt.
+
+    Each question is built from a sentence of a lesson, so the sentence is
+    the context the answer needs; this checks compression keeps it.
+    """
+    import compression
+    import metrics
+
+    rng = random.Random(seed)
+    found = 0
+    for i in range(count):
+        tutor = app.active_tutors[names[i % len(names)]]
+        prose = [
+            s
+            for _, s in compression.units(tutor.markdown_text)
+            if s.endswith(".") and len(s.split()) > 10
+        ]
+        sentence = rng.choice(prose)
+        words = [w for w in compression.terms(sentence) if w not in compression.STOPWORDS]
+        keywords = " ".join(rng.sample(words, min(5, len(words))))
+        question = f"What does the lesson say about {keywords}?"
+        overview, passages = tutor.context(question, metrics.Trace("bench"))
+        prompt = "\n".join([overview] + passages)
+        found += sentence in prompt
+    return found / count
+
+
+def bench_quiz(app, names, rounds):
+    timings = []
+    for i in range(rounds):
+        tutor = app.active_tutors[names[i % len(names)]]
+        start = time.perf_counter()
+        tutor.generate_quiz()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def bench_sessions(flask_app, names, slo, limit):
+    """Highest concurrency at which /ask p95 stays within the SLO."""
+    best = 0
+    concurrency = 1
+    while concurrency <= limit:
+        latencies, errors = ask_latencies(flask_app, names, concurrency * 4, concurrency)
+        p95 = percentile(latencies, 95)
+        print(f"  {concurrency:>3} sessions: p95 {p95:.3f}s, {errors} errors")
+        if errors or p95 > slo:
+            break
+        best = concurrency
+        concurrency *= 2
+    return best
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for key, value in results.items():
+        if key not in baseline or not baseline[key]:
+            continue
+        old = baseline[key]
+        if key in HIGHER_IS_BETTER:
+            change = (old - value) / old
+        else:
+            change = (value - old) / old
+        marker = "REGRESSION" if change > tolerance else "ok"
+        print(f"  {key:<20} {old:>10.4f} -> {value:>10.4f}  ({change:+.0%}) {marker}")
+        if change > tolerance:
+            regressions.append(key)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lessons", type=int, default=10)
+    parser.add_argument("--sections", type=int, default=12)
+    parser.add_argument("--asks", type=int, default=50)
+    parser.add_argument("--quizzes", type=int, default=5)
+    parser.add_argument("--chat-latency", type=float, default=0.2)
+    parser.add_argument("--embed-latency", type=float, default=0.05)
+    parser.add_argument("--slo", type=float, default=2.0, help="p95 seconds for /ask")
+    parser.add_argument("--max-sessions", type=int, default=128)
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--save-baseline", action="store_true")
+    args = parser.parse_args(argv)
+
+    if not args.save_baseline and not BASELINE.exists():
+        # Without a baseline nothing is compared, and a run would pass regardless
+        print(f"No baseline at {BASELINE}; run with --save-baseline to record one.", file=sys.stderr)
+        return 2
+
+    stub, app = setup(args)
+
+    print(f"Building {args.lessons} lessons...")
+    build_seconds, names = bench_build(app)
+
+    import metrics
+
+    print(f"Asking {args.asks} questions...")
+    tokens_before = metrics.counter("tutor_tokens_total", op="ask", kind="prompt")
+    retrieved_before = metrics.counter("context_tokens_total", kind="retrieved")
+    kept_before = metrics.counter("context_tokens_total", kind="kept")
+    latencies, errors = ask_latencies(app.app, names, args.asks)
+    if errors:
+        print(f"  {errors} /ask requests failed")
+    prompt_tokens = metrics.counter("tutor_tokens_total", op="ask", kind="prompt") - tokens_before
+    # Share of the retrieved lesson text (overview and passages) sent to the model
+    retrieved = metrics.counter("context_tokens_total", kind="retrieved") - retrieved_before
+    kept = metrics.counter("context_tokens_total", kind="kept") - kept_before
+
+    print("Checking the context kept for answers...")
+    context_recall = bench_context(app, names, args.asks)
+
+    print(f"Generating {args.quizzes} quizzes...")
+    quiz_timings = bench_quiz(app, names, args.quizzes)
+
+    print("Ramping concurrent sessions...")
+    max_sessions = bench_sessions(app.app, names, args.slo, args.max_sessions)
+
+    results = {
+        "build_seconds": build_seconds,
+        "ask_p50": percentile(latencies, 50),
+        "ask_p95": percentile(latencies, 95),
+        "ask_p99": percentile(latencies, 99),
+        "ask_prompt_tokens": prompt_tokens / max(1, len(latencies)),
+        "context_kept_ratio": kept / max(1, retrieved),
+        "context_recall": context_recall,
+        "quiz_seconds": sum(quiz_timings) / len(quiz_timings),
+        "max_sessions": max_sessions,
+        "github_requests": stub.requests,
+    }
+    stub.stop()
+
+    print(json.dumps(results, indent=2))
+
+    if args.save_baseline:
+        BASELINE.write_text(json.dumps(results, indent=2) + "\n")
+        print(f"Saved baseline to {BASELINE}")
+        return 0
+
+    print("Compared with baseline:")
+    regressions = compare(results, json.loads(BASELINE.read_text()), args.tolerance)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
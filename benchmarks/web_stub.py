@@ -0,0 +1,136 @@
+"""A local web server for exercising webingest.py offline.
+
+Serves synthetic lesson pages (site chrome, scripts, a <main> with
+headings, lists and code) with ETag and Last-Modified validators and
+answers conditional requests with 304. Running it as a module ingests
+every page twice and checks the second pass downloads nothing:
+
+    python -m benchmarks.web_stub --pages 20
+"""
+
+import argparse
+import hashlib
+import os
+import random
+import sys
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from benchmarks.github_stub import TOPICS
+
+
+def make_page(index, seed=0):
+    rng = random.Random(seed * 1000 + index)
+    topic = TOPICS[index % len(TOPICS)]
+    items = "".join(f"<li>{rng.choice(TOPICS)} with {rng.choice(TOPICS)}</li>" for _ in range(4))
+    paragraphs = "".join(
+        f"<p>{' '.join(rng.choice(TOPICS + ['the', 'and', 'uses']) for _ in range(30)).capitalize()}.</p>"
+        for _ in range(5)
+    )
+    return f"""<!DOCTYPE html>
+<html><head><title>{topic} guide &amp; reference</title>
+<style>body {{ font-family: sans-serif; }}</style>
+<script>window.analytics = true;</script></head>
+<body>
+<nav><a href="/">Home</a> <a href="/about">About</a></nav>
+<main>
+<h1>{topic}</h1>
+{paragraphs}
+<h2>Try it</h2>
+<ol>{items}</ol>
+<pre><code>&lt;section class="{topic}"&gt;&lt;/section&gt;</code></pre>
+</main>
+<footer>Copyright</footer>
+</body></html>"""
+
+
+class WebStub:
+    def __init__(self, pages, port=0):
+        self.pages = pages  # path -> html
+        self.modified = formatdate(time.time(), usegmt=True)
+        self.requests = 0
+        self.downloads = 0  # responses that carried a body
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                stub.requests += 1
+                html = stub.pages.get(self.path)
+                if html is None:
+                    self.send_response(404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+
+                etag = '"' + hashlib.sha1(html.encode()).hexdigest() + '"'
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.end_headers()
+                    return
+
+                body = html.encode()
+                stub.downloads += 1
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("ETag", etag)
+                self.send_header("Last-Modified", stub.modified)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--host-interval", type=float, default=0.05)
+    args = parser.parse_args(argv)
+
+    os.environ["WEB_ALLOW_PRIVATE"] = "1"  # the stub is on loopback
+
+    from store import MemoryStore
+    from webingest import WebIngester
+
+    stub = WebStub({f"/page{i}.html": make_page(i) for i in range(args.pages)}).start()
+    urls = [f"{stub.url}/page{i}.html" for i in range(args.pages)]
+    ingester = WebIngester(MemoryStore(), host_interval=args.host_interval)
+
+    start = time.perf_counter()
+    pages = ingester.ingest(urls)
+    first = time.perf_counter() - start
+    print(f"First pass: {len(pages)} pages, {stub.downloads} downloads in {first:.2f}s")
+    print(f"Sample:\n{pages[0].markdown[:300]}\n")
+
+    downloads = stub.downloads
+    start = time.perf_counter()
+    pages = ingester.ingest(urls)
+    second = time.perf_counter() - start
+    changed = sum(page.changed for page in pages)
+    print(f"Second pass: {stub.downloads - downloads} downloads, {changed} changed in {second:.2f}s")
+    stub.stop()
+
+    ok = len(pages) == args.pages and stub.downloads == downloads and not changed
+    print("OK" if ok else "FAIL: unchanged pages were downloaded again")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,156 @@
+"""Offline course bundles.
+
+A bundle is one file holding everything needed to serve a course with no
+network access: the lesson markdown, chunk ids, embedding vectors and any
+pre-generated quizzes. Layout:
+
+    MAGIC | version (uint16) | header length (uint32) | JSON header
+    | padding to 4 bytes | float32 vectors, one row per chunk
+
+The vector block is memory-mapped on load, so startup cost does not grow
+with the number of API calls the course originally took.
+
+Usage:
+    python bundle.py export https://github.com/owner/course course.bundle
+    python bundle.py info course.bundle
+"""
+
+import json
+import mmap
+import struct
+import sys
+import time
+import numpy as np
+from dotenv import load_dotenv
+
+MAGIC = b"HWAB"
+VERSION = 1
+
+
+def export_bundle(path, tutors, out_file):
+    """Write the tutors of course `path` to a single bundle file."""
+    from repo import get_snapshot
+
+    snapshot = get_snapshot(path) or {}
+    lessons = []
+    rows = []
+    for tutor in tutors:
+        data = tutor.export()
+        ids = list(data["vectors"])
+        lessons.append(
+            {
+                "name": data["name"],
+                "markdown": data["markdown"],
+                "chunks": ids,
+                "offset": len(rows),
+                "quizzes": data["quizzes"],
+            }
+        )
+        rows.extend(data["vectors"][i] for i in ids)
+
+    vectors = np.asarray(rows, dtype=np.float32)
+    header = json.dumps(
+        {
+            "version": VERSION,
+            "repo": path,
+            "sha": snapshot.get("sha"),
+            "files": snapshot.get("files", {}),
+            "created": int(time.time()),
+            "dim": int(vectors.shape[1]) if len(rows) else 0,
+            "rows": len(rows),
+            "lessons": lessons,
+        }
+    ).encode()
+
+    prefix = MAGIC + struct.pack("<HI", VERSION, len(header)) + header
+    padding = b"\0" * (-len(prefix) % 4)
+
+    with open(out_file, "wb") as f:
+        f.write(prefix + padding)
+        f.write(vectors.tobytes())
+
+    print(f"Exported {len(lessons)} lessons ({len(rows)} chunks) to {out_file}")
+
+
+def read_bundle(bundle_file):
+    """Return (header, vectors) with the vectors memory-mapped from disk."""
+    with open(bundle_file, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    if mm[:4] != MAGIC:
+        raise ValueError(f"{bundle_file} is not a course bundle")
+    version, length = struct.unpack_from("<HI", mm, 4)
+    if version > VERSION:
+        raise ValueError(f"{bundle_file} uses bundle version {version}")
+
+    start = 10
+    header = json.loads(mm[start : start + length])
+    offset = start + length
+    offset += -offset % 4
+
+    vectors = np.frombuffer(
+        mm, dtype=np.float32, count=header["rows"] * header["dim"], offset=offset
+    ).reshape(header["rows"], header["dim"])
+    return header, vectors
+
+
+def load_bundle(bundle_file):
+    """Build tutors from a bundle and seed the repo snapshot, without API calls."""
+    from repo import seed_snapshot
+    from tutor import MarkdownTutor
+
+    header, vectors = read_bundle(bundle_file)
+
+    tutors = []
+    for lesson in header["lessons"]:
+        rows = vectors[lesson["offset"] : lesson["offset"] + len(lesson["chunks"])]
+        tutor = MarkdownTutor.from_export(
+            {
+                "name": lesson["name"],
+                "markdown": lesson["markdown"],
+                "vectors": dict(zip(lesson["chunks"], rows)),
+                "quizzes": lesson["quizzes"],
+            }
+        )
+        tutors.append(tutor)
+
+    seed_snapshot(
+        header["repo"],
+        {
+            "sha": header["sha"],
+            "etag": None,
+            "files": header["files"],
+            "lessons": {l["name"]: l["markdown"] for l in header["lessons"]},
+        },
+    )
+    print(f"Loaded {len(tutors)} lessons of {header['repo']} from {bundle_file}")
+    return header["repo"], tutors
+
+
+def main(argv):
+    load_dotenv()  # GitHub token and API URL, before repo.py reads them
+    if len(argv) == 3 and argv[0] == "export":
+        from repo import get_repo, repo_path
+        from tutor import MarkdownTutor
+
+        path = repo_path(argv[1])
+        tutors = []
+        for name, markdown_text in get_repo(path).items():
+            tutor = MarkdownTutor(markdown_text, name)
+            tutor.generate_quiz()  # ship a ready-made quiz with every lesson
+            tutors.append(tutor)
+        export_bundle(path, tutors, argv[2])
+    elif len(argv) == 2 and argv[0] == "info":
+        header, vectors = read_bundle(argv[1])
+        print(f"{header['repo']} @ {header['sha']} (bundle v{header['version']})")
+        print(f"{header['rows']} chunks, {header['dim']} dimensions")
+        for lesson in header["lessons"]:
+            print(f"  {lesson['name']}: {len(lesson['chunks'])} chunks")
+    else:
+        print(__doc__)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,109 @@
+"""Server-sent event channels, one per page.
+
+With CHANNELS=1 the tutor page opens a single GET /channel event stream
+for all of its panels. Opening a panel is a small POST to
+/channel/<id>/command ({"type": "open", "lesson"}) which resolves the
+tutor and the student's session once and keeps them on the channel;
+chat questions, quiz starts and quiz answers are POSTed the same way,
+and everything the tutor says comes back over the one stream: answer
+tokens as they are generated, quiz questions and grading feedback.
+Events carry JSON data, all but ready with the lesson it is for:
+
+    ready     {"id"}                  the channel id to POST commands to
+    token     {"lesson", "text"}      the next piece of a streamed answer
+    reset     {"lesson"}              a retried answer starts over
+    answer    {"lesson", "text"}      the complete answer
+    question  {"lesson", "text"}      a quiz question (pushed, never polled)
+    feedback  {"lesson", "text"}      grading of a quiz answer
+
+The page closes its stream whenever no panel is showing. Channels are
+off by default because an open stream holds a worker for as long as it
+lasts: under a sync worker (gunicorn's default, or the dev server
+without threads) each page would tie up a whole worker, so turn them on
+only behind threaded or async workers. Without them the page uses the
+plain /ask and /quiz requests.
+
+Channels live in the worker that opened them, so with several workers
+the load balancer must keep a student on one worker (sticky sessions)
+for the POSTs to find their channel.
+"""
+
+import json
+import queue
+import threading
+import uuid
+
+import metrics
+
+HEARTBEAT = 15  # seconds; keeps proxies from closing an idle stream
+
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class Panel:
+    def __init__(self, name, tutor, session):
+        self.name = name
+        self.tutor = tutor
+        self.session = session
+        self.lock = threading.Lock()  # one command at a time per panel
+        self.quiz = None  # (size, Future) of a quiz prefetched for this student
+
+
+class Channel:
+    def __init__(self, sid):
+        self.id = uuid.uuid4().hex
+        self.sid = sid
+        self.panels = {}  # lesson -> Panel
+        self.events = queue.Queue()
+        self.closed = False
+
+    def open_panel(self, name, tutor, session):
+        # A panel reopened after being hidden keeps its session
+        return self.panels.setdefault(name, Panel(name, tutor, session))
+
+    def close_panel(self, name):
+        self.panels.pop(name, None)
+
+    def send(self, event, **data):
+        if not self.closed:
+            self.events.put(sse(event, data))
+
+    def stream(self):
+        """The response body: events as they are sent, heartbeats in between."""
+        yield sse("ready", {"id": self.id})
+        while not self.closed:
+            try:
+                yield self.events.get(timeout=HEARTBEAT)
+            except queue.Empty:
+                yield ": heartbeat\n\n"
+
+
+class Hub:
+    def __init__(self):
+        self.channels = {}
+        self.lock = threading.Lock()
+
+    def open(self, sid):
+        channel = Channel(sid)
+        with self.lock:
+            self.channels[channel.id] = channel
+        metrics.inc("channels_opened_total")
+        return channel
+
+    def get(self, channel_id, sid):
+        channel = self.channels.get(channel_id)
+        return channel if channel and channel.sid == sid else None
+
+    def close(self, channel):
+        channel.closed = True
+        with self.lock:
+            self.channels.pop(channel.id, None)
+
+    def serve(self, channel):
+        """Stream a channel, dropping it once the client disconnects."""
+        try:
+            yield from channel.stream()
+        finally:
+            self.close(channel)
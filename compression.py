@@ -0,0 +1,180 @@
+"""Extractive compression of retrieved context.
+
+Retrieved chunks are 800 characters of raw lesson markdown, most of which
+has nothing to do with the question. Before generation, the chunks are
+cleaned (slide markers, HTML comments, images and link targets removed),
+split into units (sentences, headings, list items, whole code blocks),
+and the units are scored against the question with BM25, with a unit's
+section heading counting for part of its score. The best units that fit
+in CONTEXT_TOKENS are kept and returned in their original order.
+
+The lesson overview that opens every prompt is compressed the same way,
+once per lesson, to OVERVIEW_TOKENS against a fixed query, so it stays
+identical across questions. That is a trade-off against prompt caching:
+OpenAI only caches prefixes of 1024 tokens or more, and the default
+overview (300 tokens after about 50 of instructions) is well short of
+that, so /ask prompts get no cache hits. Sending 350 tokens at the full
+price still costs less than a 1024-token prefix at the cached price.
+Set OVERVIEW_TOKENS to about 1000 to get the cache hits (and the lower
+time to first token) back instead; tutor_tokens_total{op="ask",
+kind="cached"} shows whether they happen. Quiz prompts carry the
+uncompressed overview and usually reach the minimum either way.
+
+Sentences are split with NLTK's punkt model when it is installed (see
+nltkfix.py) and with a regular expression otherwise.
+"""
+
+import math
+import os
+import re
+from collections import Counter
+
+import metrics
+from batcher import count_tokens
+
+BUDGET = int(os.getenv("CONTEXT_TOKENS", "600"))
+OVERVIEW_BUDGET = int(os.getenv("OVERVIEW_TOKENS", "300"))
+ENABLED = os.getenv("CONTEXT_COMPRESSION", "1") != "0"
+
+FENCED = re.compile(r"(```.*?(?:```|$))", re.S)
+HTML_COMMENT = re.compile(r"<!--.*?-->", re.S)  # reveal.js slide markers and notes
+SLIDE_RULE = re.compile(r"^\s*(?:---+|\*\*\*+|___+)\s*$", re.M)
+IMAGE = re.compile(r"!\[[^\]]*\]\([^)]*\)")
+LINK = re.compile(r"\[([^\]]+)\]\([^)]*\)")
+URL = re.compile(r"<?https?://[^\s>)]+>?")
+BLANK_LINES = re.compile(r"\n{3,}")
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+(?=[A-Z0-9`\"'(])")
+BLOCK_LINE = re.compile(r"^\s*(?:#{1,6}\s|[-*+]\s|\d+[.)]\s|\|)")
+WORD = re.compile(r"[a-z0-9]+")
+
+STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how i in into is it its me of on "
+    "or so than that the their then there these this those to was we what when where "
+    "which who why will with you your".split()
+)
+
+_split_sentences = None
+
+
+def clean(text):
+    """Drop slide markup and link targets, leaving code blocks untouched."""
+    parts = FENCED.split(text)
+    for i in range(0, len(parts), 2):  # odd parts are code blocks
+        part = HTML_COMMENT.sub("", parts[i])
+        part = SLIDE_RULE.sub("", part)
+        part = IMAGE.sub("", part)
+        part = LINK.sub(r"\1", part)
+        parts[i] = URL.sub("", part)
+    return BLANK_LINES.sub("\n\n", "".join(parts)).strip()
+
+
+def sentences(paragraph):
+    global _split_sentences
+    if _split_sentences is None:
+        try:
+            import nltk
+
+            nltk.sent_tokenize("Punkt is installed.")
+            _split_sentences = nltk.sent_tokenize
+        except (ImportError, LookupError):
+            _split_sentences = SENTENCE_END.split
+    return [s for s in _split_sentences(paragraph) if s.strip()]
+
+
+def units(text):
+    """[(heading, unit)] for one cleaned chunk, in order."""
+    result = []
+    heading = ""
+    paragraph = []
+
+    def flush():
+        if paragraph:
+            result.extend((heading, s) for s in sentences(" ".join(paragraph)))
+            paragraph.clear()
+
+    for i, part in enumerate(FENCED.split(text)):
+        if i % 2:
+            flush()
+            result.append((heading, part))
+            continue
+        for line in part.splitlines():
+            if not line.strip():
+                flush()
+            elif BLOCK_LINE.match(line):
+                flush()
+                if line.lstrip().startswith("#"):
+                    heading = line.strip("# \t")
+                result.append((heading, line.strip()))
+            else:
+                paragraph.append(line.strip())
+        flush()
+    return result
+
+
+def terms(text):
+    return WORD.findall(text.lower())
+
+
+def bm25(query, texts, k1=1.2, b=0.75):
+    counts = [Counter(terms(t)) for t in texts]
+    if not counts:
+        return []
+    n = len(counts)
+    average = sum(sum(c.values()) for c in counts) / n or 1
+    df = Counter(term for c in counts for term in c)
+    wanted = set(query)
+
+    scores = []
+    for c in counts:
+        length = sum(c.values())
+        score = 0.0
+        for term in wanted:
+            f = c.get(term)
+            if f:
+                idf = math.log(1 + (n - df[term] + 0.5) / (df[term] + 0.5))
+                score += idf * f * (k1 + 1) / (f + k1 * (1 - b + b * length / average))
+        scores.append(score)
+    return scores
+
+
+def compress(query, texts, budget=BUDGET, skip=()):
+    """Keep the sentences of `texts` most relevant to `query`, within `budget` tokens.
+
+    Units in `skip` (e.g. already in the prompt) are left out. Returns one
+    string per text that kept anything, in the original order.
+    """
+    texts = [clean(t) for t in texts]
+    if not ENABLED:
+        return texts
+
+    found = [
+        (d, heading, unit)
+        for d, text in enumerate(texts)
+        for heading, unit in units(text)
+        if unit not in skip
+    ]
+    if not found:
+        return []
+    wanted = [t for t in terms(query) if t not in STOPWORDS] or terms(query)
+    scores = bm25(wanted, [unit for _, _, unit in found])
+    heading_scores = bm25(wanted, [heading for _, heading, _ in found])
+    scores = [s + 0.3 * h for s, h in zip(scores, heading_scores)]
+    sizes = [count_tokens(unit) for _, _, unit in found]
+
+    order = sorted((i for i in range(len(found)) if scores[i] > 0), key=lambda i: -scores[i])
+    if not order:
+        order = range(len(found))  # nothing matches: keep the top chunk's start
+
+    keep, used = set(), 0
+    for i in order:
+        if used + sizes[i] <= budget:
+            keep.add(i)
+            used += sizes[i]
+
+    metrics.inc("context_tokens_total", sum(sizes), kind="retrieved")
+    metrics.inc("context_tokens_total", used, kind="kept")
+
+    passages = {}
+    for i in sorted(keep):
+        passages.setdefault(found[i][0], []).append(found[i][2])
+    return ["\n".join(passages[d]) for d in sorted(passages)]
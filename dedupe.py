@@ -0,0 +1,98 @@
+"""Find boilerplate chunks repeated across the lessons of a course.
+
+Lessons repeat the same blocks almost word for word (what learning
+objectives are, break / lab / homework sections, resource lists). Each
+chunk gets a MinHash signature over its word 5-grams; LSH banding finds
+earlier chunks it may repeat, and if the estimated Jaccard similarity to
+one of them reaches DEDUPE_THRESHOLD it joins that chunk's cluster. Every
+cluster is embedded once, through its first chunk, with the vector
+reused for the others.
+
+Chunks that turn up in several lessons are tagged with the number of
+lessons sharing them (shared_lessons), and with DEDUPE_DOWNRANK=1 the
+tutors rank them behind a lesson's own content.
+"""
+
+import hashlib
+import os
+import re
+import threading
+from collections import defaultdict
+
+import numpy as np
+
+import metrics
+
+THRESHOLD = float(os.getenv("DEDUPE_THRESHOLD", "0.8"))
+DOWNRANK = os.getenv("DEDUPE_DOWNRANK") == "1"
+SHINGLE = 5
+BANDS, ROWS = 16, 4  # 64 hash functions; pairs from ~0.5 similarity are checked
+
+WORD = re.compile(r"\w+")
+_PRIME = (1 << 61) - 1
+_rng = np.random.default_rng(1)
+_A = _rng.integers(1, 1 << 32, BANDS * ROWS, dtype=np.uint64)
+_B = _rng.integers(0, 1 << 32, BANDS * ROWS, dtype=np.uint64)
+
+
+def signature(text):
+    words = WORD.findall(text.lower())
+    shingles = {" ".join(words[i : i + SHINGLE]) for i in range(max(1, len(words) - SHINGLE + 1))}
+    hashes = np.array(
+        [int.from_bytes(hashlib.blake2b(s.encode(), digest_size=4).digest(), "little") for s in shingles],
+        dtype=np.uint64,
+    )
+    return ((np.outer(hashes, _A) + _B) % _PRIME).min(axis=0)
+
+
+class Index:
+    """Incremental clustering: chunks are added one lesson at a time.
+
+    A chunk joins the cluster of the first earlier chunk it is similar
+    enough to, so it can be embedded as soon as its lesson arrives.
+    """
+
+    def __init__(self, threshold=THRESHOLD):
+        self.threshold = threshold
+        self.signatures = {}  # representative id -> signature
+        self.buckets = defaultdict(list)
+        self.rep = {}  # chunk id -> representative id
+        self.lessons_of = defaultdict(set)  # representative id -> lessons
+        self.members = defaultdict(set)  # representative id -> chunk ids
+        self.lock = threading.Lock()
+
+    def add(self, lesson, cid, text):
+        """Add a chunk of `lesson`; returns the id whose vector it should use."""
+        with self.lock:
+            return self._add(lesson, cid, text)
+
+    def _add(self, lesson, cid, text):
+        rep = self.rep.get(cid)
+        if rep is None:
+            sig = signature(text)
+            keys = [(band, sig[band * ROWS : (band + 1) * ROWS].tobytes()) for band in range(BANDS)]
+            candidates = dict.fromkeys(c for key in keys for c in self.buckets.get(key, ()))
+            rep = next(
+                (c for c in candidates if np.mean(self.signatures[c] == sig) >= self.threshold),
+                None,
+            )
+            if rep is None:
+                rep = cid
+                self.signatures[cid] = sig
+                for key in keys:
+                    self.buckets[key].append(cid)
+            self.rep[cid] = rep
+            self.members[rep].add(cid)
+            metrics.inc("dedupe_chunks_total", kind="unique" if rep == cid else "aliased")
+        self.lessons_of[rep].add(lesson)
+        return rep
+
+    def shared(self):
+        """{chunk id: number of lessons} for chunks found in more than one lesson."""
+        with self.lock:
+            return {
+                cid: len(lessons)
+                for rep, lessons in self.lessons_of.items()
+                if len(lessons) > 1
+                for cid in self.members[rep]
+            }
@@ -0,0 +1,175 @@
+"""Approximate memory accounting for tutors.
+
+Sizes are estimates: Python objects are measured with sys.getsizeof
+recursively, and Chroma's vectors are counted as float32 rows plus the
+stored chunk text. Set TRACEMALLOC=1 before starting the app to also get
+the top allocation sites from tracemalloc snapshots.
+
+The /debug/memory endpoint is off unless DEBUG_TOKEN is set, and then
+needs it as a bearer token; this script sends the same variable.
+
+    DEBUG_TOKEN=... python diagnostics.py [http://localhost:3000]
+"""
+
+import hashlib
+import json
+import os
+import resource
+import sys
+import tracemalloc
+import urllib.request
+
+from dotenv import load_dotenv
+
+_last_snapshot = None
+
+
+def deep_size(obj, seen=None, depth=6):
+    """sys.getsizeof summed over containers and object attributes."""
+    if seen is None:
+        seen = set()
+    if id(obj) in seen or depth < 0:
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj, 0)
+    if isinstance(obj, (str, bytes, bytearray, int, float, bool)):
+        return size
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            size += deep_size(key, seen, depth - 1) + deep_size(value, seen, depth - 1)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for item in obj:
+            size += deep_size(item, seen, depth - 1)
+    elif hasattr(obj, "__dict__"):
+        size += deep_size(vars(obj), seen, depth - 1)
+    return size
+
+
+def index_size(tutor):
+    """Bytes held by the tutor's Chroma collection (vectors + chunk text)."""
+    collection = tutor.vs._collection
+    count = collection.count()
+    if not count:
+        return 0
+    sample = collection.peek(1)
+    dim = len(sample["embeddings"][0])
+    text = sum(len(d.encode()) for d in tutor.vs.get(include=["documents"])["documents"])
+    # float32 vectors, counted twice: once stored, once in the HNSW index
+    return count * dim * 4 * 2 + text
+
+
+def tutor_footprint(tutor):
+    footprint = {
+        "index": index_size(tutor),
+        "markdown": deep_size(tutor.markdown_text),
+        "caches": deep_size(tutor.answers) + deep_size(tutor.quizzes),
+        "session": deep_size(tutor.session),
+        "clients": deep_size(tutor.llms, depth=4) + deep_size(tutor.embeddings, depth=3),
+    }
+    footprint["total"] = sum(footprint.values())
+    return footprint
+
+
+def top_allocations(limit=10):
+    """Top allocation sites, and growth since the previous call."""
+    global _last_snapshot
+    if not tracemalloc.is_tracing():
+        return None
+
+    snapshot = tracemalloc.take_snapshot().filter_traces(
+        [tracemalloc.Filter(False, tracemalloc.__file__)]
+    )
+    top = [
+        {"site": str(stat.traceback[0]), "bytes": stat.size, "count": stat.count}
+        for stat in snapshot.statistics("lineno")[:limit]
+    ]
+    growth = []
+    if _last_snapshot is not None:
+        growth = [
+            {"site": str(stat.traceback[0]), "bytes": stat.size_diff}
+            for stat in snapshot.compare_to(_last_snapshot, "lineno")[:limit]
+        ]
+    _last_snapshot = snapshot
+    return {"top": top, "growth": growth}
+
+
+def session_footprints(live):
+    """Bytes per student session, from (session id, lesson, state) triples.
+
+    Session ids are cookies, so the report names sessions by a hash of
+    theirs instead.
+    """
+    per_session = {}
+    for sid, lesson, state in live:
+        key = hashlib.sha256(sid.encode()).hexdigest()[:12]
+        entry = per_session.setdefault(key, {"bytes": 0, "lessons": {}})
+        size = deep_size(state)
+        entry["lessons"][lesson] = entry["lessons"].get(lesson, 0) + size
+        entry["bytes"] += size
+    return per_session
+
+
+def memory_report(tutors, limit=10, live_sessions=()):
+    per_tutor = {name: tutor_footprint(t) for name, t in list(tutors.items())}
+    ranked = sorted(per_tutor.items(), key=lambda item: item[1]["total"], reverse=True)
+    per_session = session_footprints(live_sessions)
+    top_sessions = sorted(per_session, key=lambda key: per_session[key]["bytes"], reverse=True)
+    return {
+        # ru_maxrss is KiB on Linux
+        "rss_peak_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        "tutors_total_bytes": sum(f["total"] for f in per_tutor.values()),
+        "sessions_total_bytes": sum(f["session"] for f in per_tutor.values())
+        + sum(entry["bytes"] for entry in per_session.values()),
+        "live_sessions": len(per_session),
+        "tutors": per_tutor,
+        "top_tutors": [name for name, _ in ranked[:limit]],
+        "sessions": {key: per_session[key] for key in top_sessions[:limit]},
+        "allocations": top_allocations(limit),
+    }
+
+
+def start_tracing():
+    if os.getenv("TRACEMALLOC") and not tracemalloc.is_tracing():
+        tracemalloc.start(int(os.getenv("TRACEMALLOC_FRAMES", "1")))
+
+
+def _mb(n):
+    return f"{n / 2**20:8.2f} MB"
+
+
+def main(argv):
+    load_dotenv()  # DEBUG_TOKEN
+    url = (argv[0] if argv else "http://localhost:3000").rstrip("/")
+    req = urllib.request.Request(url + "/debug/memory")
+    if os.getenv("DEBUG_TOKEN"):
+        req.add_header("Authorization", f"Bearer {os.getenv('DEBUG_TOKEN')}")
+    with urllib.request.urlopen(req) as resp:
+        report = json.load(resp)
+
+    print(f"Peak RSS         {_mb(report['rss_peak_bytes'])}")
+    print(f"All tutors       {_mb(report['tutors_total_bytes'])}")
+    print(f"All sessions     {_mb(report['sessions_total_bytes'])}")
+    print(f"\n{'tutor':<32} {'index':>11} {'session':>11} {'total':>11}")
+    for name in report["top_tutors"]:
+        f = report["tutors"][name]
+        print(f"{name[:32]:<32} {_mb(f['index'])} {_mb(f['session'])} {_mb(f['total'])}")
+
+    print(f"\n{report['live_sessions']} sessions in memory, largest:")
+    for key, entry in report["sessions"].items():
+        print(f"  {key}  {_mb(entry['bytes'])}  across {len(entry['lessons'])} lessons")
+
+    allocations = report.get("allocations")
+    if allocations:
+        print("\nTop allocation sites:")
+        for a in allocations["top"]:
+            print(f"  {_mb(a['bytes'])}  {a['site']}")
+        if allocations["growth"]:
+            print("\nGrowth since last report:")
+            for a in allocations["growth"]:
+                print(f"  {a['bytes'] / 2**20:+8.2f} MB  {a['site']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,146 @@
+"""Find a course's lessons from the schedule in its README.
+
+Course READMEs list the lessons in teaching order under a `## Schedule`
+heading, usually as a table of links. parse_schedule() turns that section
+into an ordered manifest of links, each classified as in-repo (with the
+repository path it points to) or external. Links to the same target are
+listed once, at their first mention.
+
+In-repo links may be relative paths or absolute URLs to the repo on
+github.com (blob/tree/raw) or to its GitHub Pages site, where a lesson's
+slides at Lessons/Lesson01.html come from Lessons/Lesson01.md.
+"""
+
+import posixpath
+import re
+from urllib.parse import unquote, urlsplit
+
+SCHEDULE = re.compile(
+    r"^#{1,3}[ \t]*(?:class[ \t]+|course[ \t]+)?schedule\b[^\n]*\n(.*?)(?=^#{1,2}[ \t]|\Z)",
+    re.IGNORECASE | re.MULTILINE | re.DOTALL,
+)
+MARKDOWN_LINK = re.compile(r"(?<!!)\[([^\]]*)\]\(\s*<?([^)\s>]+)>?(?:\s+\"[^\"]*\")?\s*\)")
+BARE_URL = re.compile(r"(?<![(<\[])\bhttps?://[^\s)<>\]|]+")
+GITHUB = re.compile(r"^/([^/]+)/([^/]+)/(?:blob|tree|raw)/[^/]+/(.+)$")
+RAW = re.compile(r"^/([^/]+)/([^/]+)/[^/]+/(.+)$")
+PAGES_HOST = re.compile(r"^([^.]+)\.github\.io$", re.IGNORECASE)
+
+
+class Link:
+    def __init__(self, title, url, kind, path=None):
+        self.title = title
+        self.url = url
+        self.kind = kind  # "repo" or "external"
+        self.path = path  # repository path, for in-repo links
+
+    def to_dict(self):
+        return {"title": self.title, "url": self.url, "kind": self.kind, "path": self.path}
+
+
+def schedule_section(readme):
+    match = SCHEDULE.search(readme)
+    return match.group(1) if match else None
+
+
+def repo_link(url, repo):
+    """The repository path `url` points to, or None if it leads elsewhere."""
+    owner, name = repo.lower().split("/")
+    parts = urlsplit(url)
+
+    if not parts.scheme and not parts.netloc:
+        if not parts.path or parts.path.startswith("#"):
+            return None
+        path = posixpath.normpath(unquote(parts.path).lstrip("/"))
+        return None if path.startswith("..") else path
+
+    host = parts.netloc.lower()
+    path = unquote(parts.path)
+    if host in ("github.com", "www.github.com"):
+        match = GITHUB.match(path)
+    elif host == "raw.githubusercontent.com":
+        match = RAW.match(path)
+    else:
+        pages = PAGES_HOST.match(host)
+        if not pages or pages.group(1).lower() != owner:
+            return None
+        segments = path.strip("/").split("/", 1)
+        if segments[0].lower() != name:
+            return None
+        rest = segments[1] if len(segments) > 1 else ""
+        if rest.endswith(".html"):
+            rest = rest[: -len(".html")] + ".md"
+        return rest.rstrip("/") or None
+
+    if not match or (match.group(1).lower(), match.group(2).lower()) != (owner, name):
+        return None
+    return match.group(3).rstrip("/")
+
+
+def parse_schedule(readme, repo):
+    """Ordered, de-duplicated [Link] from the README's schedule (empty if none)."""
+    section = schedule_section(readme)
+    if section is None:
+        return []
+
+    found = []  # (position, title, url)
+    for match in MARKDOWN_LINK.finditer(section):
+        found.append((match.start(), match.group(1).strip(), match.group(2)))
+    for match in BARE_URL.finditer(section):
+        found.append((match.start(), "", match.group(0).rstrip(".,;")))
+    found.sort()
+
+    manifest = []
+    seen = set()
+    for _, title, url in found:
+        path = repo_link(url, repo)
+        key = path.lower() if path else url.split("#")[0].rstrip("/")
+        if key in seen:
+            continue
+        seen.add(key)
+        kind = "repo" if path else "external"
+        manifest.append(Link(title or posixpath.basename(path or url), url, kind, path))
+    return manifest
+
+
+# Labs are named Lab01.md, Lab-2.md, Lab_3_Forms.md or live under Labs/;
+# "Labels.md" or "Lesson07-Collaboration.md" are lessons
+LAB_NAME = re.compile(r"^labs?(?![a-z])", re.IGNORECASE)
+LAB_TITLE = re.compile(r"^\W*labs?\b", re.IGNORECASE)
+
+
+def is_lab(path, title=""):
+    """Whether a scheduled link is a lab, by its title, file name or folder."""
+    if LAB_TITLE.match(title):
+        return True
+    return any(LAB_NAME.match(segment) for segment in path.split("/"))
+
+
+def is_lesson(path):
+    """A lesson found by listing the Lessons/ folder, for courses without a schedule.
+
+    With no schedule to go by, any file mentioning "lab" is taken for one.
+    """
+    filename = posixpath.basename(path).lower()
+    return filename.endswith(".md") and "lab" not in filename
+
+
+def lesson_paths(manifest):
+    """Repository paths of the lessons in the manifest, in schedule order.
+
+    A link to a folder (no extension) stands for the README.md inside it.
+    """
+    paths = []
+    for link in manifest:
+        if link.kind != "repo":
+            continue
+        path = link.path
+        if not posixpath.splitext(path)[1]:
+            path = f"{path}/README.md"
+        if (
+            path.lower().endswith(".md")
+            and not is_lab(path, link.title)
+            and path.lower() != "readme.md"
+            and path not in paths
+        ):
+            paths.append(path)
+    return paths
@@ -0,0 +1,325 @@
+"""Background tutor builds.
+
+/tutor enqueues a build and returns straight away. A job lists the
+course and streams its lessons through a pipeline (see pipeline.py):
+each lesson is downloaded, split on a worker pool (separate processes
+with JOB_PROCESSES > 0, so CPU work never competes with request
+threads), embedded (boilerplate repeated across lessons only once, see
+dedupe.py) and indexed while the next ones are still being fetched, and
+every tutor is registered as soon as its lesson is done so the page can
+fill in progressively.
+
+Job progress, built lessons and course listings are also written to the
+shared store, so other app workers can report on and serve them.
+"""
+
+import multiprocessing
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import metrics
+from store import pack_vectors, unpack_vectors
+
+
+def split_chunks(markdown_text):
+    """Worker entry point: split one lesson into {chunk id: text}."""
+    from tutor import split_lesson
+
+    return {cid: d.page_content for cid, d in split_lesson(markdown_text).items()}
+
+
+class Build:
+    """A new lesson on its way through the build pipeline."""
+
+    def __init__(self, name, markdown_text):
+        self.name = name
+        self.markdown_text = markdown_text
+        self.chunks = None  # chunk id -> text
+        self.plan = {}  # chunk id -> id of the chunk whose vector it may reuse
+        self.vectors = None
+
+
+class Job:
+    def __init__(self, path, commit=None):
+        self.id = uuid.uuid4().hex
+        self.path = path
+        self.commit = commit  # the commit being built, once known
+        self.status = "queued"
+        self.lessons = {}  # lesson name -> pending | ready | failed
+        self.error = None
+        self.finished_at = None
+        self._finished = threading.Event()
+
+    @property
+    def done(self):
+        return self.status in ("ready", "failed")
+
+    def wait(self, timeout=None):
+        return self._finished.wait(timeout)
+
+    def to_dict(self):
+        lessons = dict(self.lessons)  # pipeline threads update it as they go
+        ready = sum(1 for state in lessons.values() if state == "ready")
+        return {
+            "id": self.id,
+            "path": self.path,
+            "commit": self.commit,
+            "status": self.status,
+            "lessons": lessons,
+            "ready": ready,
+            "total": len(lessons),
+            "error": self.error,
+        }
+
+
+class JobQueue:
+    def __init__(self, tutors, store, workers=2, processes=0, keep=200):
+        self.tutors = tutors  # shared registry of lesson name -> MarkdownTutor
+        self.store = store
+        self.jobs = {}
+        self.running = {}  # course path -> latest unfinished job, so builds are not doubled
+        self.building = {}  # course path -> lock held by the build in progress
+        self.keep = keep
+        self.lock = threading.Lock()
+        self.runner = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="jobs")
+        self.processes = processes
+        self._pool = None
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            if self.processes:
+                # spawn, not fork: the web process has threads and open sockets
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.processes,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            else:
+                self._pool = ThreadPoolExecutor(
+                    max_workers=4, thread_name_prefix="split"
+                )
+        return self._pool
+
+    def submit(self, path, commit=None):
+        """Enqueue a build of `path`, or return the one already in progress.
+
+        Builds are shared per (course, commit): a running job is reused
+        unless `commit` (e.g. from a push webhook) is newer than the commit
+        it is building.
+        """
+        with self.lock:
+            job = self.running.get(path)
+            if job and (commit is None or job.commit in (None, commit)):
+                metrics.inc("job_submits_total", result="shared")
+                return job
+            metrics.inc("job_submits_total", result="new")
+            job = Job(path, commit)
+            self.jobs[job.id] = job
+            self.running[path] = job
+            self._prune()
+
+        self._publish(job)
+        self.runner.submit(self._run, job)
+        return job
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def status(self, job_id):
+        """Progress of a job started by this or any other worker."""
+        job = self.jobs.get(job_id)
+        return job.to_dict() if job else self.store.get(f"job:{job_id}")
+
+    def _publish(self, job):
+        self.store.set(f"job:{job.id}", job.to_dict())
+
+    def load_lesson(self, name, markdown_text=None):
+        """Rebuild a tutor from the lesson record another worker stored.
+
+        Chunks whose vectors are in the record are not embedded again, so
+        with new markdown only the edited chunks cost API calls.
+        """
+        record = self.store.get(f"lesson:{name}")
+        if not record:
+            return None
+
+        from tutor import MarkdownTutor
+
+        record["vectors"] = unpack_vectors(record["vectors"])
+        if markdown_text is not None and markdown_text != record["markdown"]:
+            tutor = MarkdownTutor(markdown_text, name, vectors=record["vectors"])
+            self._save_lesson(tutor)
+        else:
+            tutor = MarkdownTutor.from_export(record)
+            tutor.load_caches(self.store.get(f"cache:{name}"))
+        self.tutors[name] = tutor
+        return tutor
+
+    def _save_lesson(self, tutor):
+        data = tutor.export()
+        data["vectors"] = pack_vectors(data["vectors"])
+        self.store.set(f"lesson:{tutor.name}", data)
+
+    def _prune(self):
+        finished = sorted(
+            (j for j in self.jobs.values() if j.done), key=lambda j: j.finished_at
+        )
+        for job in finished[: max(0, len(self.jobs) - self.keep)]:
+            del self.jobs[job.id]
+
+    def _run(self, job):
+        with self.lock:
+            building = self.building.setdefault(job.path, threading.Lock())
+        # A build for a newer commit waits for the one in progress, so the
+        # two never update the same tutors at once
+        with building:
+            self._build(job)
+
+    def _build(self, job):
+        job.status = "building"
+        try:
+            # Inside the try: a missing dependency must fail the job, not
+            # leave it queued and the course blocked for good
+            from batcher import EmbeddingBatcher
+            from pipeline import Pipeline, Stage
+            from repo import FETCH_CONCURRENCY, list_repo
+            from tutor import MarkdownTutor
+            import dedupe
+            import models
+            import webingest
+
+            listing = list_repo(job.path)
+            job.commit = listing.sha
+            job.lessons = {f.name: "pending" for f in listing.files}
+            self._publish(job)
+
+            clusters = dedupe.Index()
+            vectors = {}  # cluster representative -> vector, for near-duplicates to reuse
+            batcher = EmbeddingBatcher(models.embeddings())
+            claim = threading.Lock()
+            built = []
+
+            def source():
+                yield from listing.files
+                if webingest.ENABLED:
+                    # Pages the schedule links to, after the course's own lessons
+                    yield from webingest.urls(listing.manifest)
+
+            def fetch(item):
+                if isinstance(item, str):
+                    page = webingest.ingester(self.store).fetch(item)
+                    if not page or not page.markdown.strip():
+                        return None
+                    name, markdown_text = webingest.lesson_name(page), page.markdown
+                    with claim:
+                        if name in job.lessons:
+                            print(f"Skipping {item}: {name!r} is already a lesson")
+                            return None
+                        job.lessons[name] = "pending"
+                else:
+                    name, markdown_text = item.name, listing.fetch(item)
+
+                tutor = self.tutors.get(name)
+                if tutor:
+                    # Only re-embed the chunks that changed since the last build
+                    if any(tutor.update(markdown_text)):
+                        self._save_lesson(tutor)
+                elif not self.load_lesson(name, markdown_text):
+                    return Build(name, markdown_text)
+                job.lessons[name] = "ready"
+                self._publish(job)
+                return None
+
+            def split(build):
+                build.chunks = self.pool.submit(split_chunks, build.markdown_text).result()
+                return build
+
+            def plan(build):
+                for cid, text in build.chunks.items():
+                    build.plan[cid] = clusters.add(build.name, cid, text)
+                return build
+
+            def embed(builds):
+                # Every lesson waiting here goes into the same packed requests.
+                # Near-duplicates reuse a vector embedded for an earlier lesson;
+                # if that lesson failed there is none, and they embed their own.
+                groups = {
+                    b.name: {cid: b.chunks[cid] for cid, rep in b.plan.items() if rep not in vectors}
+                    for b in builds
+                }
+                done, failed = {}, {}
+                batcher.embed_groups(groups, done.__setitem__, failed.__setitem__)
+
+                results = []
+                for build in builds:
+                    if build.name in failed:
+                        results.append(failed[build.name])
+                        continue
+                    fresh = done[build.name]
+                    for cid, vector in fresh.items():
+                        vectors.setdefault(build.plan[cid], vector)
+                    build.vectors = {
+                        cid: fresh[cid] if cid in fresh else vectors[rep]
+                        for cid, rep in build.plan.items()
+                    }
+                    results.append(build)
+                return results
+
+            def index(build):
+                shared = clusters.shared()
+                tagged = {cid: shared[cid] for cid in build.chunks if cid in shared}
+                tutor = MarkdownTutor(
+                    build.markdown_text, build.name, vectors=build.vectors, shared=tagged
+                )
+                self.tutors[build.name] = tutor
+                self._save_lesson(tutor)
+                return build.name
+
+            def on_error(stage, item, e):
+                name = getattr(item, "name", item)  # web links fail by URL
+                print(f"Failed to {stage} {name}: {e}")
+                if name in job.lessons:
+                    job.lessons[name] = "failed"
+                job.error = str(e)
+                self._publish(job)
+
+            stages = [
+                Stage("fetch", fetch, workers=FETCH_CONCURRENCY),
+                Stage("split", split, workers=self.processes or 4),
+                Stage("dedupe", plan),
+                # One worker: the batcher caps concurrent requests at EMBED_IN_FLIGHT
+                Stage("embed", embed, batch=True),
+                Stage("index", index),
+            ]
+            for name in Pipeline(stages, on_error).run(source()):
+                built.append(name)
+                job.lessons[name] = "ready"
+                self._publish(job)
+            listing.save()
+
+            # Lessons built later may repeat chunks of earlier ones
+            shared = clusters.shared()
+            metrics.inc("dedupe_chunks_total", len(shared), kind="shared")
+            for name in built:
+                tutor = self.tutors[name]
+                tagged = {cid: shared[cid] for cid in tutor.chunk_ids if cid in shared}
+                if tagged != tutor.shared:
+                    tutor.tag_shared(tagged)
+                    self._save_lesson(tutor)
+
+            ready = [n for n, state in job.lessons.items() if state == "ready"]
+            self.store.set(f"course:{job.path}", {"lessons": ready})
+            job.status = "ready" if len(ready) == len(job.lessons) else "failed"
+        except Exception as e:
+            print(f"Build of {job.path} failed: {e}")
+            job.status = "failed"
+            job.error = str(e)
+        finally:
+            job.finished_at = time.time()
+            self._publish(job)
+            with self.lock:
+                if self.running.get(job.path) is job:
+                    del self.running[job.path]
+            job._finished.set()
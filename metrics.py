@@ -0,0 +1,168 @@
+"""In-process metrics for the tutor pipeline.
+
+Counters and histograms live in plain dicts behind one lock and are
+rendered in the Prometheus text format at /metrics. Set TRACE_LOG=1 to
+also log one JSON line per traced call (stage timings, tokens, chunks).
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+TRACE_LOG = bool(os.getenv("TRACE_LOG"))
+
+logger = logging.getLogger("tutor.trace")
+if TRACE_LOG and not logger.handlers:
+    logger.addHandler(logging.StreamHandler())
+    logger.setLevel(logging.INFO)
+
+_lock = threading.Lock()
+_counters = {}  # (name, labels) -> value
+_histograms = {}  # (name, labels) -> [count per bucket..., sum, count]
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name, amount=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def counter(name, **labels):
+    """Current value of one counter (0 if never incremented)."""
+    with _lock:
+        return _counters.get(_key(name, labels), 0)
+
+
+def observe(name, value, **labels):
+    key = _key(name, labels)
+    with _lock:
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = [0] * (len(BUCKETS) + 2)
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                hist[i] += 1
+        hist[-2] += value
+        hist[-1] += 1
+
+
+def _labels(labels, **extra):
+    pairs = list(labels) + sorted(extra.items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    with _lock:
+        counters = dict(_counters)
+        histograms = {k: list(v) for k, v in _histograms.items()}
+
+    lines = []
+    for name in sorted({n for n, _ in counters}):
+        lines.append(f"# TYPE {name} counter")
+        for (n, labels), value in counters.items():
+            if n == name:
+                lines.append(f"{name}{_labels(labels)} {value}")
+
+    for name in sorted({n for n, _ in histograms}):
+        lines.append(f"# TYPE {name} histogram")
+        for (n, labels), hist in histograms.items():
+            if n != name:
+                continue
+            for bound, count in zip(BUCKETS, hist):
+                lines.append(f"{name}_bucket{_labels(labels, le=bound)} {count}")
+            lines.append(f"{name}_bucket{_labels(labels, le='+Inf')} {hist[-1]}")
+            lines.append(f"{name}_sum{_labels(labels)} {hist[-2]:.6f}")
+            lines.append(f"{name}_count{_labels(labels)} {hist[-1]}")
+
+    return "\n".join(lines) + "\n"
+
+
+class Trace:
+    """Timings and counts for one ask / generate_quiz / answer_quiz call."""
+
+    def __init__(self, op, **fields):
+        self.op = op
+        self.fields = fields  # logged, but kept out of metric labels
+        self.stages = {}
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.completion_tokens = 0
+        self.cost = 0.0  # estimated USD, from models.record_call
+        self.chunks = 0
+        self.cache_hit = False
+        self.start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.stages[name] = self.stages.get(name, 0) + elapsed
+
+    def usage(self, message):
+        """Add the token counts reported on an LLM response message."""
+        usage = getattr(message, "usage_metadata", None) or {}
+        self.prompt_tokens += usage.get("input_tokens", 0)
+        self.completion_tokens += usage.get("output_tokens", 0)
+        # Prompt tokens served from the provider's prompt cache
+        details = usage.get("input_token_details") or {}
+        self.cached_tokens += details.get("cache_read", 0)
+
+    def finish(self, error=None):
+        elapsed = time.perf_counter() - self.start
+        status = "error" if error else "ok"
+
+        observe("tutor_call_seconds", elapsed, op=self.op, status=status)
+        for stage, seconds in self.stages.items():
+            observe("tutor_stage_seconds", seconds, op=self.op, stage=stage)
+        inc("tutor_tokens_total", self.prompt_tokens, op=self.op, kind="prompt")
+        inc("tutor_tokens_total", self.cached_tokens, op=self.op, kind="cached")
+        inc("tutor_tokens_total", self.completion_tokens, op=self.op, kind="completion")
+        inc("tutor_cache_total", op=self.op, result="hit" if self.cache_hit else "miss")
+        if self.chunks:
+            inc("tutor_retrieved_chunks_total", self.chunks, op=self.op)
+
+        if TRACE_LOG:
+            logger.info(
+                json.dumps(
+                    {
+                        "op": self.op,
+                        **self.fields,
+                        "status": status,
+                        "error": str(error) if error else None,
+                        "seconds": round(elapsed, 4),
+                        "stages": {k: round(v, 4) for k, v in self.stages.items()},
+                        "prompt_tokens": self.prompt_tokens,
+                        "cached_tokens": self.cached_tokens,
+                        "completion_tokens": self.completion_tokens,
+                        "cost_usd": round(self.cost, 6),
+                        "chunks": self.chunks,
+                        "cache_hit": self.cache_hit,
+                    }
+                )
+            )
+
+
+@contextmanager
+def trace(op, **fields):
+    t = Trace(op, **fields)
+    try:
+        yield t
+    except Exception as e:
+        t.finish(error=e)
+        raise
+    t.finish()
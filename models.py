@@ -0,0 +1,187 @@
+"""Factories for the chat and embedding models used by the tutors.
+
+Every model is created through chat_model() / embeddings(), so the
+backend can be swapped without touching tutor.py. MODEL_BACKEND names a
+module with its own chat_model(**kwargs) and embeddings() functions
+(e.g. benchmarks.fakes); it is read from the environment so process-pool
+workers pick it up too.
+
+Each LLM call names its task (rewrite, answer, quiz, grade) and gets the
+model configured for it: TUTOR_MODEL_<TASK> and TUTOR_TEMPERATURE_<TASK>
+override the defaults below. record_call() reports per-task latency,
+tokens and estimated cost so the routing can be tuned.
+
+Query embeddings are memoised per request and process-wide, keyed by
+model and normalised text, so a repeated query string is embedded once.
+Chat and query-embedding calls get their deadlines, retries and hedging
+from resilience.py, so the clients themselves never retry.
+"""
+
+import contextvars
+import importlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import metrics
+import resilience
+
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", "10000"))
+
+# Rewrite and grading are short, yes/no-style outputs: small model, no sampling
+TASKS = {
+    "rewrite": {"model": "gpt-4.1-nano", "temperature": 0.0},
+    "answer": {"model": "gpt-4o-mini", "temperature": 0.4},
+    "quiz": {"model": "gpt-4o-mini", "temperature": 0.4},
+    "grade": {"model": "gpt-4.1-nano", "temperature": 0.0},
+}
+
+# USD per million tokens: (input, cached input, output). MODEL_PRICES takes
+# a JSON object in the same shape to add or correct entries.
+PRICES = {
+    "gpt-4.1-nano": (0.10, 0.025, 0.40),
+    "gpt-4.1-mini": (0.40, 0.10, 1.60),
+    "gpt-4.1": (2.00, 0.50, 8.00),
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "gpt-4o": (2.50, 1.25, 10.00),
+}
+PRICES.update({k: tuple(v) for k, v in json.loads(os.getenv("MODEL_PRICES", "{}")).items()})
+
+_query_vectors = OrderedDict()  # (model, text) -> vector, least recently used first
+_query_lock = threading.Lock()
+_request_vectors = contextvars.ContextVar("request_vectors", default=None)
+
+
+def _backend():
+    name = os.getenv("MODEL_BACKEND")
+    return importlib.import_module(name) if name else None
+
+
+def use_backend(name):
+    """Route all new models through module `name` (None for OpenAI)."""
+    if name:
+        os.environ["MODEL_BACKEND"] = name
+    else:
+        os.environ.pop("MODEL_BACKEND", None)
+
+
+def task_settings(task):
+    settings = dict(TASKS[task])
+    settings["model"] = os.getenv(f"TUTOR_MODEL_{task.upper()}", settings["model"])
+    temperature = os.getenv(f"TUTOR_TEMPERATURE_{task.upper()}")
+    if temperature is not None:
+        settings["temperature"] = float(temperature)
+    return settings
+
+
+def chat_model(task=None, **kwargs):
+    if task:
+        kwargs = {**task_settings(task), **kwargs}
+    backend = _backend()
+    if backend:
+        return backend.chat_model(**kwargs)
+
+    from langchain_openai import ChatOpenAI
+
+    kwargs.setdefault("model", "gpt-4o-mini")
+    kwargs.setdefault("temperature", 0.4)
+    # resilience.call owns retries and the overall deadline
+    if task:
+        kwargs.setdefault("timeout", resilience.POLICIES[task].deadline)
+    kwargs.setdefault("max_retries", 0)
+    kwargs.setdefault("stream_usage", True)  # token counts on streamed answers too
+    return ChatOpenAI(**kwargs)
+
+
+def model_name(llm):
+    return getattr(llm, "model_name", None) or getattr(llm, "model", type(llm).__name__)
+
+
+def cost(model, usage):
+    """Estimated USD for one response's usage_metadata (0 for unknown models)."""
+    prices = PRICES.get(model)
+    if not prices:
+        return 0.0
+    cached = (usage.get("input_token_details") or {}).get("cache_read", 0)
+    fresh = usage.get("input_tokens", 0) - cached
+    return (
+        fresh * prices[0] + cached * prices[1] + usage.get("output_tokens", 0) * prices[2]
+    ) / 1e6
+
+
+def record_call(task, llm, message, seconds):
+    """Count one LLM call by task and model; returns its estimated cost."""
+    model = model_name(llm)
+    usage = getattr(message, "usage_metadata", None) or {}
+    usd = cost(model, usage)
+    metrics.observe("llm_call_seconds", seconds, task=task, model=model)
+    metrics.inc("llm_tokens_total", usage.get("input_tokens", 0), task=task, model=model, kind="prompt")
+    metrics.inc("llm_tokens_total", usage.get("output_tokens", 0), task=task, model=model, kind="completion")
+    metrics.inc("llm_cost_usd_total", usd, task=task, model=model)
+    return usd
+
+
+def embeddings():
+    backend = _backend()
+    if backend:
+        return MemoEmbeddings(backend.embeddings())
+
+    from langchain_openai import OpenAIEmbeddings
+
+    # batcher.py and resilience.call ("index") size and retry document requests,
+    # so let each call go out as one
+    return MemoEmbeddings(OpenAIEmbeddings(chunk_size=2048, request_timeout=60, max_retries=0))
+
+
+def normalise(text):
+    return " ".join(text.split()).casefold()
+
+
+@contextmanager
+def embedding_scope():
+    """Memoise query embeddings for the duration of one request."""
+    token = _request_vectors.set({})
+    try:
+        yield
+    finally:
+        _request_vectors.reset(token)
+
+
+class MemoEmbeddings:
+    """Wraps an embedding model so each query string is embedded only once."""
+
+    def __init__(self, inner):
+        self.inner = inner
+        self.model = getattr(inner, "model", type(inner).__name__)
+
+    def embed_documents(self, texts):
+        # Chunks are already keyed by content hash, so these never repeat
+        return self.inner.embed_documents(texts)
+
+    def embed_query(self, text):
+        key = (self.model, normalise(text))
+
+        scoped = _request_vectors.get()
+        if scoped is not None and key in scoped:
+            metrics.inc("query_embedding_cache_total", scope="request", result="hit")
+            return scoped[key]
+
+        with _query_lock:
+            vector = _query_vectors.get(key)
+            if vector is not None:
+                _query_vectors.move_to_end(key)
+        if vector is not None:
+            metrics.inc("query_embedding_cache_total", scope="process", result="hit")
+        else:
+            metrics.inc("query_embedding_cache_total", scope="process", result="miss")
+            vector = resilience.call("embed", self.inner.embed_query, text)
+            with _query_lock:
+                _query_vectors[key] = vector
+                while len(_query_vectors) > EMBED_CACHE_SIZE:
+                    _query_vectors.popitem(last=False)
+
+        if scoped is not None:
+            scoped[key] = vector
+        return vector
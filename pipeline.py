@@ -0,0 +1,180 @@
+"""Streaming stages for course ingestion.
+
+A build used to download the whole course before splitting anything, and
+split every lesson before embedding any, so the network, the CPU and the
+embeddings API took turns. Here each stage runs on its own threads and
+hands items to the next through a bounded queue: a lesson is split while
+the next one downloads and embedded while a third is split, so a build
+takes about as long as its slowest stage rather than the sum of them.
+
+The queues hold at most PIPELINE_CAPACITY items, so a slow stage holds
+back the ones before it (backpressure) instead of letting downloaded
+lessons or chunks pile up in memory. The time a stage spends blocked on
+a full queue is recorded as pipeline_blocked_seconds{stage}; the stage
+reported most is the one waiting on the bottleneck.
+"""
+
+import os
+import queue
+import threading
+import time
+
+import metrics
+
+CAPACITY = int(os.getenv("PIPELINE_CAPACITY", "4"))
+
+_DONE = object()
+
+
+class Stage:
+    def __init__(self, name, fn, workers=1, batch=False):
+        self.name = name
+        # item -> item for the next stage, or None to drop it. A batch stage
+        # gets every item waiting in its queue at once and returns one
+        # result per item, where an exception stands for a failed item.
+        self.fn = fn
+        self.workers = workers
+        self.batch = batch
+
+
+class Stopped(Exception):
+    pass
+
+
+class Pipeline:
+    def __init__(self, stages, on_error, capacity=CAPACITY):
+        self.stages = stages
+        self.on_error = on_error  # (stage name, item, exception), the item is dropped
+        self.capacity = capacity
+        self.stopped = threading.Event()
+        self.errors = []
+
+    def _put(self, q, item, stage):
+        start = time.perf_counter()
+        while True:
+            if self.stopped.is_set():
+                raise Stopped()
+            try:
+                q.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        metrics.observe("pipeline_blocked_seconds", time.perf_counter() - start, stage=stage)
+
+    def _get(self, q):
+        while True:
+            if self.stopped.is_set():
+                raise Stopped()
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+
+    def _feed(self, source, out):
+        try:
+            for item in source:
+                self._put(out, item, "source")
+        except Stopped:
+            return
+        except Exception as e:
+            self.errors.append(e)
+        try:
+            self._put(out, _DONE, "source")
+        except Stopped:
+            pass
+
+    def _call(self, stage, items):
+        start = time.perf_counter()
+        try:
+            results = stage.fn(items) if stage.batch else [stage.fn(items[0])]
+        except Exception as e:
+            results = [e] * len(items)
+        metrics.observe("pipeline_stage_seconds", time.perf_counter() - start, stage=stage.name)
+        return results
+
+    def _failed(self, stage, item, e):
+        metrics.inc("pipeline_items_total", stage=stage.name, result="failed")
+        try:
+            self.on_error(stage.name, item, e)
+        except Exception as handler_error:
+            # A broken handler must not take the worker, and the build, down with it
+            print(f"Error handler for {stage.name} failed: {handler_error}")
+
+    def _work(self, stage, inbox, out, remaining):
+        try:
+            finished = False
+            while not finished:
+                item = self._get(inbox)
+                if item is _DONE:
+                    break
+                items = [item]
+                while stage.batch:
+                    try:
+                        item = inbox.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is _DONE:
+                        finished = True
+                        break
+                    items.append(item)
+
+                for item, result in zip(items, self._call(stage, items)):
+                    if isinstance(result, Exception):
+                        self._failed(stage, item, result)
+                    elif result is None:
+                        metrics.inc("pipeline_items_total", stage=stage.name, result="dropped")
+                    else:
+                        metrics.inc("pipeline_items_total", stage=stage.name, result="passed")
+                        self._put(out, result, stage.name)
+            self._put(inbox, _DONE, stage.name)  # let the other workers finish too
+        except Stopped:
+            pass
+        except Exception as e:
+            self.errors.append(e)
+        finally:
+            # However this worker ends, the last one out passes the end along
+            with remaining[1]:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                try:
+                    self._put(out, _DONE, stage.name)
+                except Stopped:
+                    pass
+
+    def run(self, source):
+        """Push the items of `source` through every stage, yielding what comes out.
+
+        Items come out in the order they finish. An exception raised by
+        `source` itself, or one that escapes a stage, is re-raised once the
+        items already in flight are done; closing the generator early stops
+        every stage.
+        """
+        queues = [queue.Queue(self.capacity) for _ in range(len(self.stages) + 1)]
+        threads = [threading.Thread(target=self._feed, args=(source, queues[0]), daemon=True)]
+        for i, stage in enumerate(self.stages):
+            remaining = [stage.workers, threading.Lock()]
+            threads += [
+                threading.Thread(
+                    target=self._work,
+                    args=(stage, queues[i], queues[i + 1], remaining),
+                    name=f"pipeline-{stage.name}",
+                    daemon=True,
+                )
+                for _ in range(stage.workers)
+            ]
+        for thread in threads:
+            thread.start()
+
+        try:
+            while True:
+                item = queues[-1].get()
+                if item is _DONE:
+                    break
+                yield item
+        finally:
+            self.stopped.set()
+            for thread in threads:
+                thread.join()
+        if self.errors:
+            raise self.errors[0]
@@ -1,30 +1,228 @@
-from github import Github
 import os
-from dotenv import load_dotenv
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor
+import discovery
+from singleflight import Group
 
-load_dotenv()
+# .env is loaded by the entry point (app.py, bundle.main) before this is imported
+API_URL = os.getenv("GITHUB_API_URL", "https://api.github.com")
 
+# Last seen state per repo: HEAD commit, its ETag, file shas and lesson text
+_snapshots = {}
+_lock = threading.Lock()
+# Concurrent listings of the same commit share one set of lesson files
+_fetches = Group("repo_fetch")
+FETCH_CONCURRENCY = int(os.getenv("GITHUB_FETCH_CONCURRENCY", "8"))
 
-def get_repo(path):
+
+def repo_path(url):
+    """Turn a GitHub URL (or plain owner/name) into owner/name."""
+    parts = url.strip().rstrip("/").split("/")
+    if len(parts) >= 5:
+        return "/".join(parts[3:5])
+    return "/".join(parts[-2:])
+
+
+def head_sha(path, token=None):
+    """Look up the latest commit of a repo with a conditional request.
+
+    Returns (sha, etag). A 304 reply costs nothing against the rate limit
+    and means the cached snapshot is still current.
+    """
+    snapshot = _snapshots.get(path)
+    headers = {"Accept": "application/vnd.github.sha"}
+    if token:
+        headers["Authorization"] = f"token {token}"
+    if snapshot and snapshot.get("etag"):
+        headers["If-None-Match"] = snapshot["etag"]
+
+    resp = requests.get(
+        f"{API_URL}/repos/{path}/commits/HEAD", headers=headers, timeout=10
+    )
+    if resp.status_code == 304:
+        return snapshot["sha"], snapshot["etag"]
+
+    resp.raise_for_status()
+    return resp.text.strip(), resp.headers.get("ETag")
+
+
+def get_snapshot(path):
+    """Return the last fetched state of a repo, or None."""
+    return _snapshots.get(path)
+
+
+def seed_snapshot(path, snapshot):
+    """Install a snapshot loaded from elsewhere, e.g. an offline bundle."""
+    with _lock:
+        _snapshots[path] = snapshot
+
+
+def _head(path, token):
+    """(sha, etag) of the repo's HEAD, or None to use the cached snapshot."""
+    snapshot = _snapshots.get(path)
+    if snapshot and os.getenv("OFFLINE"):
+        return None
+    try:
+        return head_sha(path, token)
+    except requests.RequestException as e:
+        if snapshot:
+            print(f"Could not reach GitHub for {path}, using cached copy: {e}")
+            return None
+        raise
+
+
+def get_repo(path, force=False):
     token = os.getenv("GITHUB_PERSONAL_ACCESS_TOKEN")
-    g = Github(token) if token else Github()
+    snapshot = _snapshots.get(path)
 
-    print(f"Fetching repo: {path}")
-    repo = g.get_repo(path)
+    head = _head(path, token)
+    if head is None:
+        return dict(snapshot["lessons"])
+    sha, etag = head
 
-    folder_path = "Lessons"
-    lessons_content = {}
+    if snapshot and snapshot["sha"] == sha and not force:
+        print(f"Unchanged: {path} @ {sha[:7]}")
+        return dict(snapshot["lessons"])
+
+    listing = _fetches.do((path, sha), _list, path, sha, etag, token)
+    with ThreadPoolExecutor(max_workers=FETCH_CONCURRENCY) as pool:
+        contents = list(pool.map(listing.fetch, listing.files))
+    listing.save()
+    return {f.name: text for f, text in zip(listing.files, contents)}
+
+
+def list_repo(path, force=False):
+    """The lesson files of a course's latest commit, to be fetched one at a time.
+
+    Unlike get_repo() nothing is downloaded yet, so lessons can be
+    processed as they arrive (see pipeline.py).
+    """
+    token = os.getenv("GITHUB_PERSONAL_ACCESS_TOKEN")
+    snapshot = _snapshots.get(path)
+
+    head = _head(path, token)
+    if head is None or (snapshot and snapshot["sha"] == head[0] and not force):
+        return Listing.cached(path, snapshot)
+    sha, etag = head
+    # Shared with get_repo(): concurrent callers list a commit once, and
+    # since they get the same Listing, download each file once too
+    return _fetches.do((path, sha), _list, path, sha, etag, token)
 
-    def fetch_folder(folder):
-        contents = repo.get_contents(folder)
 
-        for item in contents:
+def lesson_name(file_path):
+    """Lesson name for a markdown file; a folder's README is named after the folder."""
+    parts = file_path.split("/")
+    if parts[-1].lower() == "readme.md" and len(parts) > 1:
+        return parts[-2]
+    return parts[-1].removesuffix(".md")
+
+
+class LessonFile:
+    def __init__(self, name, path, sha=None, text=None, item=None):
+        self.name = name
+        self.path = path
+        self.sha = sha
+        self.text = text  # None until downloaded
+        self.item = item  # the GitHub content entry to download from
+        self.lock = threading.Lock()
+
+
+class Listing:
+    """The lesson files of one commit of a course, in schedule order."""
+
+    def __init__(self, path, sha, etag, files, manifest, fresh=True):
+        self.path = path
+        self.sha = sha
+        self.etag = etag
+        self.files = files
+        self.manifest = manifest
+        self.fresh = fresh  # False when replayed from the cached snapshot
+
+    @classmethod
+    def cached(cls, path, snapshot):
+        files = [LessonFile(name, None, text=text) for name, text in snapshot["lessons"].items()]
+        return cls(path, snapshot["sha"], snapshot["etag"], files, snapshot.get("manifest", []), fresh=False)
+
+    def fetch(self, lesson):
+        """Download one lesson's markdown, unless the snapshot already has it."""
+        with lesson.lock:
+            if lesson.text is None:
+                lesson.text = lesson.item.decoded_content.decode()
+                print(f"Fetched: {lesson.item.name}")
+        return lesson.text
+
+    def save(self):
+        """Record the commit as the repo's snapshot once every lesson is fetched."""
+        if not self.fresh or any(f.text is None for f in self.files):
+            return
+        with _lock:
+            _snapshots[self.path] = {
+                "sha": self.sha,
+                "etag": self.etag,
+                "files": {f.path: f.sha for f in self.files},
+                "lessons": {f.name: f.text for f in self.files},
+                "manifest": self.manifest,
+            }
+
+
+def _list(path, sha, etag, token):
+    from github import Github, GithubException
+
+    g = Github(token, base_url=API_URL) if token else Github(base_url=API_URL)
+
+    print(f"Listing repo: {path} @ {sha[:7]}")
+    repo = g.get_repo(path, lazy=True)
+
+    snapshot = _snapshots.get(path)
+    old_files = snapshot["files"] if snapshot else {}
+    old_lessons = snapshot["lessons"] if snapshot else {}
+
+    # The README's schedule lists the lessons in teaching order
+    try:
+        readme = repo.get_contents("README.md", ref=sha).decoded_content.decode()
+        manifest = discovery.parse_schedule(readme, path)
+    except GithubException:
+        manifest = []
+    wanted = discovery.lesson_paths(manifest)
+
+    listings = {}
+
+    def listing(folder):
+        if folder not in listings:
+            try:
+                listings[folder] = {i.path: i for i in repo.get_contents(folder, ref=sha)}
+            except GithubException:
+                listings[folder] = {}
+        return listings[folder]
+
+    def fetch_folder(folder):
+        items = []
+        for item in listing(folder).values():
             if item.type == "dir":
-                fetch_folder(item.path)  # recurse into subdirectory
-            elif item.name.endswith(".md") and "lab" not in item.name.lower():
-                content = item.decoded_content.decode()
-                lessons_content[item.name.strip(".md")] = content
-                print(f"Fetched: {item.name}")
-
-    fetch_folder(folder_path)
-    return lessons_content
+                items += fetch_folder(item.path)  # recurse into subdirectory
+            elif discovery.is_lesson(item.path):
+                items.append(item)
+        return items
+
+    items = []
+    if wanted:
+        # Folders are listed once for the blob shas; only changed files download
+        for file_path in wanted:
+            item = listing(file_path.rsplit("/", 1)[0] if "/" in file_path else "").get(file_path)
+            if item:
+                items.append(item)
+            else:
+                print(f"Scheduled lesson not found: {file_path}")
+    if not items:
+        if wanted:
+            print(f"No scheduled lesson of {path} exists, listing Lessons/ instead")
+        items = fetch_folder("Lessons")
+
+    files = []
+    for item in items:
+        name = lesson_name(item.path)
+        # Blob unchanged since the last snapshot: no download needed
+        unchanged = old_files.get(item.path) == item.sha and name in old_lessons
+        files.append(LessonFile(name, item.path, item.sha, old_lessons[name] if unchanged else None, item))
+    return Listing(path, sha, etag, files, [link.to_dict() for link in manifest])
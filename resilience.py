@@ -0,0 +1,251 @@
+"""Deadlines, retries, hedging and circuit breaking for model calls.
+
+Every LLM and query-embedding call, and the document embeddings a tutor
+makes outside the build batcher, go through call(task, fn, ...):
+
+- Each task has a deadline for the whole call, retries included
+  (TUTOR_DEADLINE_<TASK> overrides the defaults below). The clients are
+  also given a request timeout and no retries of their own.
+- Transient failures (timeouts, connection errors, 429 and 5xx) are
+  retried with jittered exponential backoff while time is left.
+- Interactive tasks are hedged: if the first attempt has not answered
+  after the task's recent p95 latency, a duplicate is sent and whichever
+  finishes first wins. The loser is abandoned, not cancelled (a thread
+  cannot be interrupted), and ends at its client timeout. Code running
+  in an attempt can check abandoned() to stop publishing anything more,
+  such as streamed tokens.
+- Repeated transient failures open the task's circuit: calls fail fast
+  with Unavailable for a cool-down period, after which one trial call is
+  let through. Callers serve cached answers instead where they have them.
+"""
+
+import contextvars
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import admission
+import metrics
+
+HEDGING = os.getenv("MODEL_HEDGING", "1") != "0"
+BREAKER_THRESHOLD = int(os.getenv("BREAKER_THRESHOLD", "5"))
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", "30"))
+
+
+class Policy:
+    def __init__(self, deadline, retries, hedge_after=None):
+        self.deadline = deadline
+        self.retries = retries
+        # Hedge delay until enough latencies are known; None never hedges
+        self.hedge_after = hedge_after
+
+
+def _policy(task, deadline, retries, hedge_after=None):
+    deadline = float(os.getenv(f"TUTOR_DEADLINE_{task.upper()}", deadline))
+    return Policy(deadline, retries, hedge_after if HEDGING else None)
+
+
+POLICIES = {
+    "rewrite": _policy("rewrite", 8, 2, hedge_after=2.0),
+    "answer": _policy("answer", 45, 1, hedge_after=10.0),
+    "quiz": _policy("quiz", 90, 1),  # long and expensive: never duplicated
+    "grade": _policy("grade", 8, 2, hedge_after=2.0),
+    "embed": _policy("embed", 10, 2, hedge_after=1.0),
+    # A lesson's chunks embedded outside the build batcher (tutor updates, rehydrates)
+    "index": _policy("index", 120, 3),
+}
+
+
+class Unavailable(Exception):
+    """A model call failed for good: circuit open, deadline passed or retries used up."""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Abandoned(Exception):
+    """Raised inside an attempt that stopped because it was given up on."""
+
+
+class Breaker:
+    """Opens after `threshold` transient failures in a row."""
+
+    def __init__(self, task, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.task = task
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False  # a half-open trial call is in flight
+        self.lock = threading.Lock()
+
+    def retry_after(self):
+        if self.opened_at is None:
+            return 0
+        return max(0.0, self.opened_at + self.cooldown - time.monotonic())
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if self.trial or self.retry_after() > 0:
+                return False
+            self.trial = True
+            return True
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial = False
+
+    def release(self):
+        """A call ended without showing whether the provider is healthy."""
+        with self.lock:
+            self.trial = False
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial or self.failures >= self.threshold:
+                if self.opened_at is None or self.trial:
+                    metrics.inc("model_circuit_opens_total", task=self.task)
+                self.opened_at = time.monotonic()
+                self.trial = False
+
+
+class Latencies:
+    """Recent successful call durations, for the hedging delay."""
+
+    def __init__(self, size=200, min_samples=20):
+        self.samples = deque(maxlen=size)
+        self.min_samples = min_samples
+        self.lock = threading.Lock()
+
+    def add(self, seconds):
+        with self.lock:
+            self.samples.append(seconds)
+
+    def p95(self):
+        with self.lock:
+            if len(self.samples) < self.min_samples:
+                return None
+            ordered = sorted(self.samples)
+        return ordered[int(0.95 * (len(ordered) - 1))]
+
+
+_breakers = {task: Breaker(task) for task in POLICIES}
+_latencies = {task: Latencies() for task in POLICIES}
+_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("MODEL_CALL_THREADS", "64")), thread_name_prefix="model"
+)
+
+
+def retryable(e):
+    """Timeouts, dropped connections, rate limits and server errors."""
+    if isinstance(e, (TimeoutError, ConnectionError)):
+        return True
+    if type(e).__name__ in ("APITimeoutError", "APIConnectionError", "RateLimitError"):
+        return True
+    status = getattr(e, "status_code", None) or getattr(
+        getattr(e, "response", None), "status_code", None
+    )
+    return status in (408, 409, 429) or (isinstance(status, int) and status >= 500)
+
+
+_abandoned = contextvars.ContextVar("attempt_abandoned", default=None)
+
+
+def abandoned():
+    """Whether the attempt running in this context has been given up on."""
+    event = _abandoned.get()
+    return event is not None and event.is_set()
+
+
+def _attempt(task, policy, deadline, hedge, fn, args, kwargs):
+    """Run fn once (twice if hedged) and return the first success."""
+    start = time.monotonic()
+    # The caller's context (e.g. its cancel token) goes with fn to the pool
+    context = contextvars.copy_context()
+    gave_up = threading.Event()
+
+    def run():
+        attempt = context.copy()
+        attempt.run(_abandoned.set, gave_up)
+        return attempt.run(fn, *args, **kwargs)
+
+    try:
+        return _wait_first(task, policy, deadline, hedge, start, run)
+    finally:
+        # Whatever is still running has lost, and must not publish anything
+        gave_up.set()
+
+
+def _wait_first(task, policy, deadline, hedge, start, run):
+    pending = {_executor.submit(run)}
+
+    hedge_after = policy.hedge_after if hedge else None
+    if hedge_after is not None:
+        hedge_after = _latencies[task].p95() or hedge_after
+        done, _ = wait(pending, timeout=min(hedge_after, max(0, deadline - start)))
+        if not done and time.monotonic() < deadline:
+            metrics.inc("model_hedges_total", task=task)
+            pending.add(_executor.submit(run))
+
+    error = None
+    while pending:
+        done, pending = wait(
+            pending, timeout=max(0, deadline - time.monotonic()), return_when=FIRST_COMPLETED
+        )
+        if not done:
+            raise TimeoutError(f"{task} call exceeded its {policy.deadline}s deadline")
+        for future in done:
+            if future.exception() is None:
+                _latencies[task].add(time.monotonic() - start)
+                return future.result()
+            error = future.exception()
+    raise error
+
+
+def call(task, fn, *args, hedge=True, **kwargs):
+    """Run fn(*args, **kwargs) under the task's policy.
+
+    Pass hedge=False for calls with side effects that must not happen
+    twice at once, such as streaming tokens to a client.
+    """
+    policy = POLICIES[task]
+    breaker = _breakers[task]
+    if not breaker.allow():
+        metrics.inc("model_calls_total", task=task, result="rejected")
+        raise Unavailable(f"{task} calls are failing, try again shortly", breaker.retry_after())
+
+    deadline = time.monotonic() + policy.deadline
+    for attempt in range(policy.retries + 1):
+        try:
+            result = _attempt(task, policy, deadline, hedge, fn, args, kwargs)
+        except (admission.Cancelled, Abandoned):
+            # The caller went away: no evidence either way about the provider
+            breaker.release()
+            metrics.inc("model_calls_total", task=task, result="cancelled")
+            raise
+        except Exception as e:
+            if not retryable(e):
+                # Our request was bad, the provider is fine
+                breaker.success()
+                metrics.inc("model_calls_total", task=task, result="error")
+                raise
+            backoff = 0.5 * 2**attempt * random.uniform(0.5, 1.5)
+            if attempt == policy.retries or time.monotonic() + backoff >= deadline:
+                breaker.failure()
+                metrics.inc("model_calls_total", task=task, result="failed")
+                raise Unavailable(f"{task} call failed: {e}", breaker.retry_after()) from e
+            metrics.inc("model_retries_total", task=task)
+            time.sleep(backoff)
+        else:
+            breaker.success()
+            metrics.inc("model_calls_total", task=task, result="ok")
+            return result
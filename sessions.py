@@ -0,0 +1,68 @@
+"""Student session state with write-behind persistence.
+
+/ask and /quiz update a session in memory and return; a background
+thread writes all changed sessions to the store in one batch every
+SESSION_FLUSH_INTERVAL seconds. Only sessions waiting to be written are
+held in memory, so nothing needs evicting: once flushed, a session is
+read back from the store on its next use (lazily, on first access after
+a restart too).
+
+Across several workers a student can see state up to one flush interval
+old if consecutive requests land on different workers.
+
+The app writes the tutors' shared answer/quiz caches (cache:<lesson>)
+through here too, so caching a new answer never waits on the store.
+"""
+
+import atexit
+import threading
+
+import metrics
+
+
+class SessionCache:
+    def __init__(self, store, interval=0.5):
+        self.store = store
+        self.interval = interval
+        self.pending = {}  # key -> session not yet written to the store
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.stopped = False
+        threading.Thread(target=self._run, daemon=True, name="session-flush").start()
+        atexit.register(self.close)
+
+    def get(self, key, default):
+        with self.lock:
+            session = self.pending.get(key)
+        if session is not None:
+            return session
+        return self.store.get(key) or default()
+
+    def put(self, key, session):
+        with self.lock:
+            self.pending[key] = session
+
+    def flush(self):
+        with self.lock:
+            batch, self.pending = self.pending, {}
+        if not batch:
+            return
+        try:
+            self.store.set_many(batch)
+            metrics.inc("session_writes_total", len(batch))
+            metrics.inc("session_flushes_total")
+        except Exception as e:
+            print(f"Could not save {len(batch)} sessions, will retry: {e}")
+            with self.lock:
+                # Anything updated meanwhile is newer than what failed to save
+                self.pending = {**batch, **self.pending}
+
+    def close(self):
+        self.stopped = True
+        self.wake.set()
+        self.flush()
+
+    def _run(self):
+        while not self.stopped:
+            self.wake.wait(self.interval)
+            self.flush()
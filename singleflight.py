@@ -0,0 +1,44 @@
+"""Coalesce concurrent calls for the same key into one.
+
+The first caller for a key runs the function; callers arriving while it
+is in flight wait for the same result (or exception) instead of
+repeating the work. Nothing is remembered once the call finishes, so a
+failure is only shared with the callers that were already waiting and
+the next call tries again.
+"""
+
+import threading
+from concurrent.futures import Future
+
+import metrics
+
+
+class Group:
+    def __init__(self, name):
+        self.name = name
+        self.calls = {}  # key -> Future of the call in flight
+        self.lock = threading.Lock()
+
+    def do(self, key, fn, *args, **kwargs):
+        with self.lock:
+            future = self.calls.get(key)
+            leader = future is None
+            if leader:
+                future = self.calls[key] = Future()
+
+        if not leader:
+            metrics.inc("singleflight_total", group=self.name, result="shared")
+            return future.result()
+
+        metrics.inc("singleflight_total", group=self.name, result="leader")
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self.lock:
+                del self.calls[key]
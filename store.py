@@ -0,0 +1,135 @@
+"""Shared state for running the app as several processes.
+
+Anything a request may need from another worker lives here as JSON under
+a string key: lesson records (markdown + vectors, so any worker can
+rebuild a tutor without API calls), course and job metadata, per-student
+session state and the tutors' answer/quiz caches.
+
+TUTOR_STORE picks the backend:
+    memory://                   single process only
+    sqlite:///tutor_state.db    several workers on one host (default)
+    redis://localhost:6379/0    several hosts (needs the redis package)
+"""
+
+import base64
+import json
+import os
+import sqlite3
+import threading
+from array import array
+
+
+class MemoryStore:
+    def __init__(self):
+        self.data = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.data.get(key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, value):
+        with self.lock:
+            self.data[key] = json.dumps(value)
+
+    def set_many(self, items):
+        with self.lock:
+            for key, value in items.items():
+                self.data[key] = json.dumps(value)
+
+    def delete(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+
+
+class SQLiteStore:
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+        )
+
+    def _conn(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._conn().execute("SELECT value FROM kv WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key, value):
+        self._conn().execute(
+            "INSERT OR REPLACE INTO kv (key, value) VALUES (?, ?)", (key, json.dumps(value))
+        )
+
+    def set_many(self, items):
+        """Write several keys in one transaction (one fsync instead of many)."""
+        conn = self._conn()
+        conn.execute("BEGIN")
+        try:
+            conn.executemany(
+                "INSERT OR REPLACE INTO kv (key, value) VALUES (?, ?)",
+                [(key, json.dumps(value)) for key, value in items.items()],
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def delete(self, key):
+        self._conn().execute("DELETE FROM kv WHERE key = ?", (key,))
+
+
+class RedisStore:
+    def __init__(self, url):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        value = self.client.get(key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, value):
+        self.client.set(key, json.dumps(value))
+
+    def set_many(self, items):
+        if items:
+            self.client.mset({key: json.dumps(value) for key, value in items.items()})
+
+    def delete(self, key):
+        self.client.delete(key)
+
+
+def open_store(url=None):
+    url = url or os.getenv("TUTOR_STORE", "sqlite:///tutor_state.db")
+    if url.startswith("memory://"):
+        return MemoryStore()
+    if url.startswith("sqlite:///"):
+        return SQLiteStore(url[len("sqlite:///"):])
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisStore(url)
+    raise ValueError(f"Unknown TUTOR_STORE: {url}")
+
+
+def pack_vectors(vectors):
+    """{id: [floats]} -> {id: base64 float32}, about 4x smaller than JSON floats."""
+    return {
+        i: base64.b64encode(array("f", v).tobytes()).decode() for i, v in vectors.items()
+    }
+
+
+def unpack_vectors(packed):
+    vectors = {}
+    for i, data in packed.items():
+        row = array("f")
+        row.frombytes(base64.b64decode(data))
+        vectors[i] = row.tolist()
+    return vectors
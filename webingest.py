@@ -0,0 +1,436 @@
+"""Ingest web pages linked from a course as extra lessons.
+
+External links found in a course's schedule (see discovery.py) are
+fetched concurrently through one pooled HTTP session, with requests to
+any one host spaced at least WEB_HOST_INTERVAL seconds apart. Each page's
+ETag / Last-Modified and its converted markdown are kept in the shared
+store, so re-ingesting an unchanged page is a 304 with no body and no
+conversion, and the unchanged markdown means no new embeddings either.
+
+HTML is converted to plain markdown (headings, paragraphs, lists, code
+blocks) from the page's <main> or <article> when it has one, leaving out
+scripts, styles and navigation, so pages go through the same chunking
+and indexing as lessons. Markdown and plain-text links are used as-is.
+
+Only http(s) links to public addresses are followed, redirects included,
+and every connection goes to the address that was checked, so a host
+cannot pass the check and then re-resolve (DNS rebinding) to a private
+one. Bodies are read up to MAX_BYTES; WEB_ALLOW_PRIVATE=1 lifts the
+address check for local testing.
+
+Off unless WEB_INGEST=1.
+"""
+
+import codecs
+import hashlib
+import ipaddress
+import os
+import re
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from html import unescape
+from html.parser import HTMLParser
+from urllib.parse import urljoin, urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import NewConnectionError
+
+import metrics
+
+ENABLED = os.getenv("WEB_INGEST") == "1"
+CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "8"))
+HOST_INTERVAL = float(os.getenv("WEB_HOST_INTERVAL", "0.5"))
+MAX_PAGES = int(os.getenv("WEB_MAX_PAGES", "20"))
+MAX_BYTES = 5 * 2**20
+MAX_REDIRECTS = 5
+MAX_TITLE = 80
+# Only for local testing: lets pages on private addresses (e.g. a stub) in
+ALLOW_PRIVATE = os.getenv("WEB_ALLOW_PRIVATE") == "1"
+USER_AGENT = "HomeworkAgent (course ingestion)"
+
+HAS_MAIN = re.compile(r"<(main|article)\b", re.IGNORECASE)
+BLANK_LINES = re.compile(r"\n{3,}")
+SPACES = re.compile(r"[ \t\r\f\v]+")
+CONTROL = re.compile(r"[\x00-\x1f\x7f]")
+META_CHARSET = re.compile(rb"""<meta[^>]+charset\s*=\s*["']?([\w.:-]+)""", re.IGNORECASE)
+SKIP = {
+    "script", "style", "noscript", "template", "svg", "nav", "footer", "aside",
+    "form", "button", "iframe",
+}
+BLOCKS = {
+    "p", "div", "section", "table", "tr", "blockquote", "dl", "dt", "dd",
+    "figure", "figcaption",
+}
+
+
+class Markdown(HTMLParser):
+    """Just enough HTML to markdown for lesson pages and slides."""
+
+    def __init__(self, main_only):
+        super().__init__(convert_charrefs=True)
+        self.main_only = main_only
+        self.depth_main = 0
+        self.depth_skip = 0
+        self.lists = []  # "ul" / "ol" counters, innermost last
+        self.pre = False
+        self.out = []
+        self.title = ""
+        self.in_title = False
+
+    def emit(self, text):
+        if self.depth_skip or (self.main_only and not self.depth_main):
+            return
+        self.out.append(text)
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "title":
+            self.in_title = True
+        elif tag in ("main", "article"):
+            self.depth_main += 1
+        elif tag in SKIP:
+            self.depth_skip += 1
+        elif re.fullmatch(r"h[1-6]", tag):
+            self.emit("\n\n" + "#" * int(tag[1]) + " ")
+        elif tag in ("ul", "ol"):
+            self.lists.append(0 if tag == "ol" else None)
+        elif tag == "li":
+            indent = "  " * max(0, len(self.lists) - 1)
+            if self.lists and self.lists[-1] is not None:
+                self.lists[-1] += 1
+                self.emit(f"\n{indent}{self.lists[-1]}. ")
+            else:
+                self.emit(f"\n{indent}- ")
+        elif tag == "pre":
+            self.pre = True
+            self.emit("\n\n```\n")
+        elif tag == "code" and not self.pre:
+            self.emit("`")
+        elif tag in ("strong", "b"):
+            self.emit("**")
+        elif tag in ("em", "i"):
+            self.emit("_")
+        elif tag == "br":
+            self.emit("\n")
+        elif tag in BLOCKS:
+            self.emit("\n\n")
+
+    def handle_endtag(self, tag):
+        if tag == "title":
+            self.in_title = False
+        elif tag in ("main", "article"):
+            self.depth_main = max(0, self.depth_main - 1)
+        elif tag in SKIP:
+            self.depth_skip = max(0, self.depth_skip - 1)
+        elif re.fullmatch(r"h[1-6]", tag) or tag in BLOCKS:
+            self.emit("\n\n")
+        elif tag in ("ul", "ol"):
+            if self.lists:
+                self.lists.pop()
+            self.emit("\n")
+        elif tag == "pre":
+            self.pre = False
+            self.emit("\n```\n\n")
+        elif tag == "code" and not self.pre:
+            self.emit("`")
+        elif tag in ("strong", "b"):
+            self.emit("**")
+        elif tag in ("em", "i"):
+            self.emit("_")
+
+    def handle_data(self, data):
+        if self.in_title:
+            self.title += data
+            return
+        self.emit(data if self.pre else SPACES.sub(" ", data.replace("\n", " ")))
+
+
+def html_to_markdown(html):
+    """(title, markdown) for an HTML page."""
+    parser = Markdown(main_only=bool(HAS_MAIN.search(html)))
+    parser.feed(html)
+    parser.close()
+    lines = [line.rstrip() for line in "".join(parser.out).splitlines()]
+    text = BLANK_LINES.sub("\n\n", "\n".join(lines)).strip()
+    return " ".join(unescape(parser.title).split()), text
+
+
+def public_address(host, port):
+    """An address of `host` to connect to, or None unless all of them are public.
+
+    Course READMEs are written by anyone who can name a repo, so links to
+    loopback, private, link-local (cloud metadata) or otherwise reserved
+    addresses are refused rather than fetched from inside our network.
+    """
+    try:
+        infos = socket.getaddrinfo(host, port, proto=socket.IPPROTO_TCP)
+    except (OSError, UnicodeError, ValueError):
+        return None
+    for info in infos:
+        address = ipaddress.ip_address(info[4][0].split("%")[0])
+        if address.version == 6 and address.ipv4_mapped:
+            address = address.ipv4_mapped
+        if not ALLOW_PRIVATE and (not address.is_global or address.is_multicast):
+            return None
+    return infos[0][4][0] if infos else None
+
+
+def public_url(url):
+    """Whether `url` is http(s) on a host that only resolves to public addresses."""
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        return False
+    if ALLOW_PRIVATE:
+        return True
+    try:
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+    except ValueError:
+        return False
+    return public_address(parts.hostname, port) is not None
+
+
+class PinnedConnection:
+    """Connects to the address public_address() approved, resolving only once.
+
+    Checking a URL and then letting the HTTP client resolve the host again
+    would let a DNS record that changes in between (rebinding) send the
+    request to a private address after all. TLS still verifies the
+    certificate against the host name.
+    """
+
+    def _new_conn(self):
+        host = self._dns_host
+        address = public_address(host, self.port)
+        if address is None:
+            raise NewConnectionError(self, f"{host} is not a public address")
+        self._dns_host = address
+        try:
+            return super()._new_conn()
+        finally:
+            self._dns_host = host
+
+
+class PinnedHTTPConnection(PinnedConnection, HTTPConnection):
+    pass
+
+
+class PinnedHTTPSConnection(PinnedConnection, HTTPSConnection):
+    pass
+
+
+class PinnedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = PinnedHTTPConnection
+
+
+class PinnedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = PinnedHTTPSConnection
+
+
+class PinnedAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": PinnedHTTPConnectionPool,
+            "https": PinnedHTTPSConnectionPool,
+        }
+
+
+def charset(resp, body):
+    """The page's encoding: the header's, else a <meta> tag's, else UTF-8.
+
+    requests assumes ISO-8859-1 for text/* without a charset parameter,
+    which turns UTF-8 pages that declare it only in <meta> into mojibake.
+    Undeclared bodies that are not valid UTF-8 are read as windows-1252,
+    the legacy default browsers use.
+    """
+    if "charset" in resp.headers.get("Content-Type", "").lower():
+        name = requests.utils.get_encoding_from_headers(resp.headers)
+    else:
+        match = META_CHARSET.search(body[:4096])
+        name = match.group(1).decode("ascii") if match else None
+    if name:
+        try:
+            return codecs.lookup(name).name
+        except LookupError:
+            pass
+    try:
+        body.decode("utf-8")
+        return "utf-8"
+    except UnicodeDecodeError:
+        return "cp1252"
+
+
+class HostLimiter:
+    """Spaces out requests to the same host."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.next = {}
+        self.lock = threading.Lock()
+
+    def wait(self, host):
+        with self.lock:
+            now = time.monotonic()
+            at = max(now, self.next.get(host, 0))
+            self.next[host] = at + self.interval
+        if at > now:
+            time.sleep(at - now)
+
+
+class Page:
+    def __init__(self, url, title, markdown, changed):
+        self.url = url
+        self.title = title
+        self.markdown = markdown
+        self.changed = changed
+
+
+class WebIngester:
+    def __init__(self, store, concurrency=CONCURRENCY, host_interval=HOST_INTERVAL, timeout=15):
+        self.store = store  # page:<url> -> validators and converted markdown
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.limiter = HostLimiter(host_interval)
+        self.session = requests.Session()
+        adapter = PinnedAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        # Through a proxy the checked connection would be the proxy's, not the page's
+        self.session.trust_env = False
+        self.session.headers["User-Agent"] = USER_AGENT
+
+    def _key(self, url):
+        return "page:" + hashlib.sha256(url.encode()).hexdigest()[:32]
+
+    def _get(self, url, headers):
+        """(response, body) for `url`, checking every redirect hop.
+
+        The response is None when a hop is not a public address (see
+        public_url). The body is None for anything but a 200 within
+        MAX_BYTES; reading stops as soon as it passes the limit.
+        """
+        for _ in range(MAX_REDIRECTS + 1):
+            if not public_url(url):
+                return None, None
+            self.limiter.wait(urlsplit(url).netloc.lower())
+            resp = self.session.get(
+                url, headers=headers, timeout=self.timeout, stream=True, allow_redirects=False
+            )
+            if not resp.is_redirect:
+                break
+            resp.close()
+            url = urljoin(url, resp.headers["Location"])
+        else:
+            raise requests.TooManyRedirects(f"More than {MAX_REDIRECTS} redirects")
+
+        with resp:
+            if resp.status_code != 200:
+                return resp, None
+            length = resp.headers.get("Content-Length", "")
+            if length.isdigit() and int(length) > MAX_BYTES:
+                return resp, None
+            body = bytearray()
+            for block in resp.iter_content(64 * 1024):
+                body += block
+                if len(body) > MAX_BYTES:
+                    return resp, None
+        return resp, bytes(body)
+
+    def fetch(self, url):
+        """The page at `url` as markdown, or None if it cannot be used."""
+        cached = self.store.get(self._key(url))
+        headers = {}
+        if cached and cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached and cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+
+        try:
+            resp, body = self._get(url, headers)
+        except requests.RequestException as e:
+            print(f"Could not fetch {url}: {e}")
+            metrics.inc("web_fetch_total", result="error")
+            return Page(url, cached["title"], cached["markdown"], False) if cached else None
+
+        if resp is None:
+            print(f"Skipping {url}: not a public http(s) address")
+            metrics.inc("web_fetch_total", result="refused")
+            return None
+        if resp.status_code == 304 and cached:
+            metrics.inc("web_fetch_total", result="not_modified")
+            return Page(url, cached["title"], cached["markdown"], False)
+        if body is None:
+            print(f"Skipping {url}: HTTP {resp.status_code}, or over {MAX_BYTES} bytes")
+            metrics.inc("web_fetch_total", result="skipped")
+            return None
+
+        content_type = resp.headers.get("Content-Type", "").split(";")[0].strip().lower()
+        text = body.decode(charset(resp, body), errors="replace")
+        if content_type == "text/html":
+            title, markdown = html_to_markdown(text)
+        elif content_type in ("text/markdown", "text/plain", "text/x-markdown"):
+            title, markdown = "", text
+        else:
+            metrics.inc("web_fetch_total", result="skipped")
+            return None
+
+        title = title or urlsplit(url).path.rstrip("/").rsplit("/", 1)[-1] or urlsplit(url).netloc
+        changed = not cached or cached["markdown"] != markdown
+        self.store.set(
+            self._key(url),
+            {
+                "url": url,
+                "etag": resp.headers.get("ETag"),
+                "last_modified": resp.headers.get("Last-Modified"),
+                "title": title,
+                "markdown": markdown,
+            },
+        )
+        metrics.inc("web_fetch_total", result="downloaded")
+        return Page(url, title, markdown, changed)
+
+    def ingest(self, urls):
+        """[Page] for the usable pages among `urls`, in the same order."""
+        urls = list(dict.fromkeys(urls))
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            pages = list(pool.map(self.fetch, urls))
+        return [page for page in pages if page and page.markdown.strip()]
+
+
+_ingester = None
+_ingester_lock = threading.Lock()
+
+
+def ingester(store):
+    """The process-wide ingester, so its connections and host limits are shared."""
+    global _ingester
+    with _ingester_lock:
+        if _ingester is None:
+            _ingester = WebIngester(store)
+    return _ingester
+
+
+def urls(manifest):
+    """The external links of a course manifest worth ingesting."""
+    return [link["url"] for link in manifest if link["kind"] == "external"][:MAX_PAGES]
+
+
+def lesson_name(page):
+    """A lesson name for a page: its title, site and path.
+
+    Lesson names are global and pages on one site often share a title,
+    so the path is part of the name too. Titles are page-supplied, so
+    they are cut short and stripped of control characters.
+    """
+    title = " ".join(CONTROL.sub(" ", page.title).split())
+    if len(title) > MAX_TITLE:
+        title = title[: MAX_TITLE - 1].rstrip() + "…"
+    parts = urlsplit(page.url)
+    # Names are used in URLs, so the path's slashes become separators
+    path = " › ".join(segment for segment in parts.path.split("/") if segment)
+    return f"{title} ({parts.netloc}{': ' + path if path else ''})"
+